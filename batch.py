@@ -0,0 +1,228 @@
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+import posixpath
+import zipfile
+import asyncio
+import logging
+import shutil
+import json
+import time
+import uuid
+import os
+
+logger = logging.getLogger(__name__)
+
+BATCH_DIR = os.environ.get("BATCH_DIR", "batches")
+# Claims of one batch prepared at once; each still waits for its tenant slot and the shared stage limits
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "4"))
+BATCH_MAX_CLAIMS = int(os.environ.get("BATCH_MAX_CLAIMS", "1000"))
+# Uncompressed size an uploaded archive may expand to
+BATCH_MAX_ARCHIVE_BYTES = int(os.environ.get("BATCH_MAX_ARCHIVE_MB", "4096")) * 1024 * 1024
+
+CLAIM_FILE = "claim.json"  # Optional per-folder overrides: file_number, ia_company, appraiser_id
+
+RUNNING = "running"
+WAITING_OPENAI = "waiting_openai"
+DONE = "done"
+
+class BatchError(Exception):
+    """A manifest or archive that cannot be turned into claims (reported as HTTP 400)."""
+
+class BatchClaim(NamedTuple):
+    file_number: str
+    ia_company: str
+    appraiser_id: str
+    files: List[Tuple[str, str]]  # (upload filename, path of the staged copy)
+    directory: str
+
+def _claim_params(entry: dict, defaults: dict, fallback_file_number: Optional[str] = None) -> Tuple[str, str, str]:
+    file_number = str(entry.get("file_number") or fallback_file_number or "").strip()
+    ia_company = str(entry.get("ia_company") or defaults.get("ia_company") or "").strip()
+    appraiser_id = str(entry.get("appraiser_id") or defaults.get("appraiser_id") or "").strip()
+    if not file_number:
+        raise BatchError("Every claim needs a file_number.")
+    if not ia_company or not appraiser_id:
+        raise BatchError(f"Claim {file_number} needs an ia_company and appraiser_id.")
+    return file_number, ia_company, appraiser_id
+
+def _check_unique(claims: List[BatchClaim]):
+    if len(claims) > BATCH_MAX_CLAIMS:
+        raise BatchError(f"A batch may hold at most {BATCH_MAX_CLAIMS} claims.")
+    seen = set()
+    for claim in claims:
+        if claim.file_number in seen:
+            raise BatchError(f"File number {claim.file_number} appears more than once.")
+        seen.add(claim.file_number)
+
+def _copy(source: BinaryIO, path: str):
+    with open(path, "wb") as f:
+        shutil.copyfileobj(source, f, 1024 * 1024)
+
+def claims_from_archive(archive: BinaryIO, directory: str, defaults: dict) -> List[BatchClaim]:
+    """A zip with one top-level folder per claim. The folder name is the file number unless the folder's
+    claim.json says otherwise; every other file in the folder (at any depth) is one of its uploads."""
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise BatchError("The archive is not a valid zip file.")
+    with zf:
+        members = [m for m in zf.infolist() if not m.is_dir() and not posixpath.basename(m.filename).startswith(".")
+                   and not m.filename.startswith("__MACOSX/")]
+        if sum(m.file_size for m in members) > BATCH_MAX_ARCHIVE_BYTES:
+            raise BatchError(f"The archive expands to more than {BATCH_MAX_ARCHIVE_BYTES // (1024 * 1024)} MB.")
+        folders: Dict[str, List[zipfile.ZipInfo]] = {}
+        for member in members:
+            folder, _, rest = member.filename.partition("/")
+            if not rest:
+                raise BatchError(f"{member.filename} is not inside a claim folder.")
+            folders.setdefault(folder, []).append(member)
+        if not folders:
+            raise BatchError("The archive contains no claim folders.")
+        claims = []
+        for n, (folder, folder_members) in enumerate(sorted(folders.items())):
+            entry = {}
+            uploads = []
+            for member in folder_members:
+                if member.filename == f"{folder}/{CLAIM_FILE}":
+                    try:
+                        entry = json.loads(zf.read(member))
+                    except ValueError:
+                        raise BatchError(f"{member.filename} is not valid JSON.")
+                else:
+                    uploads.append(member)
+            file_number, ia_company, appraiser_id = _claim_params(entry, defaults, folder)
+            claim_dir = os.path.join(directory, f"{n:05d}")
+            os.makedirs(claim_dir)
+            files = []
+            for index, member in enumerate(uploads):
+                # Members are only ever read through the zip and written under our own names
+                filename = posixpath.basename(member.filename)
+                path = os.path.join(claim_dir, f"{index:03d}_{filename}")
+                with zf.open(member) as source:
+                    _copy(source, path)
+                files.append((filename, path))
+            claims.append(BatchClaim(file_number, ia_company, appraiser_id, files, claim_dir))
+    _check_unique(claims)
+    return claims
+
+def claims_from_manifest(manifest: str, uploads: List[Tuple[str, BinaryIO]], directory: str,
+                         defaults: dict) -> List[BatchClaim]:
+    """A JSON list of {"file_number", "files": [upload filenames], optional "ia_company", "appraiser_id"}
+    naming the multipart uploads that belong to each claim."""
+    try:
+        entries = json.loads(manifest)
+    except ValueError:
+        raise BatchError("The manifest is not valid JSON.")
+    if isinstance(entries, dict):
+        entries = entries.get("claims")
+    if not isinstance(entries, list) or not entries:
+        raise BatchError("The manifest must be a non-empty list of claims.")
+    by_name = {}
+    for filename, source in uploads:
+        if filename in by_name:
+            raise BatchError(f"More than one upload is named {filename}.")
+        by_name[filename] = source
+    claims = []
+    for n, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise BatchError("Each manifest entry must be an object.")
+        file_number, ia_company, appraiser_id = _claim_params(entry, defaults)
+        names = entry.get("files") or []
+        missing = [name for name in names if name not in by_name]
+        if missing or not names:
+            raise BatchError(f"Claim {file_number} lists missing files: {', '.join(missing) or 'none given'}.")
+        claim_dir = os.path.join(directory, f"{n:05d}")
+        os.makedirs(claim_dir)
+        files = []
+        for index, name in enumerate(names):
+            source = by_name[name]
+            source.seek(0)
+            path = os.path.join(claim_dir, f"{index:03d}_{os.path.basename(name)}")
+            _copy(source, path)
+            files.append((name, path))
+        claims.append(BatchClaim(file_number, ia_company, appraiser_id, files, claim_dir))
+    _check_unique(claims)
+    return claims
+
+def last_record(path: str, chunk_size: int = 64 * 1024) -> dict:
+    """The last JSON line of a results file, read backwards from its end (earlier lines hold whole reviews)."""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        tail = b""
+        while end > 0:
+            start = max(0, end - chunk_size)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+            lines = tail.rstrip(b"\n").split(b"\n")
+            if len(lines) > 1 or end == 0:
+                return json.loads(lines[-1])
+    return {}
+
+class BatchRun:
+    """One batch: per-claim results appended to results.jsonl as they finish, which any number of
+    readers can follow until the final summary line is written."""
+
+    def __init__(self, total: int, batch_id: Optional[str] = None, root: str = BATCH_DIR):
+        self.id = batch_id or uuid.uuid4().hex
+        self.directory = os.path.join(root, self.id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.results_path = os.path.join(self.directory, "results.jsonl")
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.status = RUNNING
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._lines: List[str] = []
+        self._changed = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def inputs_dir(self) -> str:
+        return os.path.join(self.directory, "inputs")
+
+    def _write(self, line: str):
+        with open(self.results_path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    async def _append(self, record: dict, final: bool = False):
+        line = json.dumps(record) + "\n"
+        # The file is written off the event loop; the lock keeps the file and followers in the same order
+        async with self._write_lock:
+            await asyncio.to_thread(self._write, line)
+            self._lines.append(line)
+            if final:
+                self.status = DONE
+            # Wake every follower, then arm a fresh event for the next line
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    async def record(self, file_number: str, result: Optional[dict] = None, error: Optional[dict] = None):
+        if error is None:
+            self.succeeded += 1
+            await self._append({"file_number": file_number, "status": "done", **result})
+        else:
+            self.failed += 1
+            await self._append({"file_number": file_number, "status": "failed", **error})
+
+    async def finish(self, **extra):
+        self.finished_at = time.time()
+        await asyncio.to_thread(shutil.rmtree, self.inputs_dir, ignore_errors=True)
+        # Followers stop once the status is done, so it only changes together with the summary line
+        await self._append({"summary": {**self.summary(), "status": DONE, **extra}}, final=True)
+
+    def summary(self) -> dict:
+        return {"batch_id": self.id, "status": self.status, "claims": self.total, "succeeded": self.succeeded,
+                "failed": self.failed, "created_at": self.created_at, "finished_at": self.finished_at}
+
+    async def follow(self):
+        """Every result line so far, then each new one as it is written, ending after the summary."""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self._lines):
+                yield self._lines[sent]
+                sent += 1
+            if self.status == DONE:
+                return
+            await changed.wait()
@@ -0,0 +1,226 @@
+"""Offline benchmark for the /vision-review pipeline.
+
+Runs the real app in-process behind uvicorn with OpenAI replaced by a fake client of configurable
+latency and SMTP pointed at a local sink, drives it with concurrent synthetic claims and writes
+latency percentiles, throughput and peak RSS to JSON so runs can be compared across commits.
+
+    python -m benchmark --requests 40 --concurrency 4 --pdf-kind scanned --pages 10 --photos 20
+    python -m benchmark --compare benchmark/results/previous.json
+
+The load client needs httpx, which the app itself does not: pip install -r requirements-dev.txt
+"""
+from benchmark.fakes import FakeAsyncOpenAI, SmtpSink
+from benchmark import fixtures
+import subprocess
+import statistics
+import threading
+import argparse
+import tempfile
+import resource
+import asyncio
+import shutil
+import socket
+import json
+import time
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmark", "results")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20, help="total reviews to submit")
+    parser.add_argument("--concurrency", type=int, default=4, help="reviews in flight at once")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed reviews before measuring")
+    parser.add_argument("--claims", type=int, default=4, help="distinct synthetic claims to cycle through")
+    parser.add_argument("--pdf-kind", choices=["text", "scanned", "none"], default="text")
+    parser.add_argument("--pages", type=int, default=8, help="estimate PDF pages")
+    parser.add_argument("--docx", action="store_true", help="add a DOCX supplement to each claim")
+    parser.add_argument("--photos", type=int, default=12, help="photos per claim")
+    parser.add_argument("--duplicate-photos", type=int, default=2, help="photos per claim that repeat earlier ones")
+    parser.add_argument("--photo-size", default="4032x3024", help="photo dimensions, WIDTHxHEIGHT")
+    parser.add_argument("--client", default="USAA", help="client rules key")
+    parser.add_argument("--openai-latency", type=float, default=2.0, help="fake GPT-4o latency in seconds")
+    parser.add_argument("--openai-jitter", type=float, default=0.5)
+    parser.add_argument("--cache", action="store_true", help="keep the result cache enabled (off by default)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result JSON path (default: benchmark/results/<time>_<commit>.json)")
+    parser.add_argument("--compare", help="earlier result JSON to print deltas against")
+    return parser.parse_args(argv)
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {"count": len(ordered), "min": ordered[0], "mean": statistics.fmean(ordered),
+            "p50": pick(50), "p90": pick(90), "p95": pick(95), "p99": pick(99), "max": ordered[-1]}
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is in kilobytes on Linux; children covers the OCR pool and tesseract processes
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def prepare_environment(args, workdir: str, smtp_port: int):
+    # Everything the app persists goes to a scratch directory; must happen before main is imported
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.update({
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(smtp_port), "SMTP_SSL": "0", "SMTP_USER": "",
+        "MAIL_OUTBOX_DIR": os.path.join(workdir, "mail_outbox"),
+        "JOB_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "JOB_FILES_DIR": os.path.join(workdir, "job_files"),
+        "RESULT_CACHE_PATH": os.path.join(workdir, "result_cache.db"),
+        "RESULT_CACHE_ENABLED": "1" if args.cache else "0",
+        "PHOTO_INDEX_PATH": os.path.join(workdir, "photo_index.db"),
+        "BATCH_DIR": os.path.join(workdir, "batches"),
+        "REPORT_STORE_DIR": os.path.join(workdir, "reports"),
+        "CLIENT_RULES_DIR": os.path.join(REPO_ROOT, "client_rules"),
+    })
+    os.environ.setdefault("YOLO_MODEL_PATH", os.path.join(REPO_ROOT, "corner-detector.pt"))
+    shutil.copy(os.path.join(REPO_ROOT, "DejaVuSans.ttf"), workdir)
+    os.chdir(workdir)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+async def submit(client, url: str, files, form: dict) -> dict:
+    start = time.perf_counter()
+    response = await client.post(url, files=[("files", f) for f in files], data=form)
+    elapsed = time.perf_counter() - start
+    body = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+    return {"status": response.status_code, "seconds": elapsed, "timings": body.get("timings"),
+            "error": body.get("error")}
+
+async def run_load(base_url: str, claims, args, total: int):
+    import httpx
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        async def one(n: int):
+            form = {"client_key": args.client, "file_number": f"BENCH-{n:05d}",
+                    "ia_company": f"bench-{n % args.concurrency}", "appraiser_id": "1"}
+            async with semaphore:
+                return await submit(client, "/vision-review", claims[n % len(claims)], form)
+        return await asyncio.gather(*(one(n) for n in range(total)))
+
+def summarise(records, wall_seconds: float) -> dict:
+    ok = [r for r in records if r["status"] == 200]
+    stages = {}
+    counts = {}
+    for record in ok:
+        timings = record["timings"] or {}
+        for stage, seconds in timings.get("stages", {}).items():
+            stages.setdefault(stage, []).append(seconds)
+        for name, value in timings.get("counts", {}).items():
+            counts.setdefault(name, []).append(value)
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "error_samples": sorted({str(r["error"]) for r in records if r["status"] != 200})[:5],
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(ok) / wall_seconds if wall_seconds else 0.0,
+        "latency_seconds": percentiles([r["seconds"] for r in ok]),
+        "stage_seconds": {stage: percentiles(values) for stage, values in sorted(stages.items())},
+        "mean_counts": {name: statistics.fmean(values) for name, values in sorted(counts.items())},
+    }
+
+def compare(current: dict, previous_path: str):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous.get('commit')} ({previous_path}):")
+    rows = [("throughput_rps", current["throughput_rps"], previous.get("throughput_rps"))]
+    for p in ("p50", "p95", "p99"):
+        rows.append((f"latency {p}", current["latency_seconds"].get(p), previous.get("latency_seconds", {}).get(p)))
+    rows.append(("peak rss self MB", current["peak_rss_mb"]["self"], previous.get("peak_rss_mb", {}).get("self")))
+    for stage, stats in current["stage_seconds"].items():
+        rows.append((f"{stage} p50", stats.get("p50"), previous.get("stage_seconds", {}).get(stage, {}).get("p50")))
+    for name, now, before in rows:
+        if now is None or not before:
+            print(f"  {name:<32} {'-' if now is None else format(now, '.3f'):>10}   (no baseline)")
+        else:
+            print(f"  {name:<32} {now:>10.3f} vs {before:>10.3f}  ({(now - before) / before * 100:+.1f}%)")
+
+def main(argv=None):
+    args = parse_args(argv)
+    width, height = (int(v) for v in args.photo_size.lower().split("x"))
+    workdir = tempfile.mkdtemp(prefix="nspxn-bench-")
+    sink = SmtpSink()
+    sink.start()
+    prepare_environment(args, workdir, sink.port)
+
+    sys.path.insert(0, REPO_ROOT)
+    import main as app_module
+    fake_openai = FakeAsyncOpenAI(args.openai_latency, args.openai_jitter, seed=args.seed)
+    app_module.client = fake_openai
+
+    print(f"Generating {args.claims} synthetic claims...")
+    claims = [fixtures.claim_files(args.pdf_kind, args.pages, args.photos, (width, height), args.docx,
+                                   min(args.duplicate_photos, args.photos), args.seed + n)
+              for n in range(args.claims)]
+    port = free_port()
+    server, thread = start_server(app_module.app, port)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        if args.warmup:
+            asyncio.run(run_load(base_url, claims, args, args.warmup))
+        print(f"Running {args.requests} reviews at concurrency {args.concurrency}...")
+        start = time.perf_counter()
+        records = asyncio.run(run_load(base_url, claims, args, args.requests))
+        wall_seconds = time.perf_counter() - start
+        # Give the background mailer a moment to drain before counting deliveries
+        deadline = time.time() + 10
+        while app_module.mailer.pending() and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        server.should_exit = True
+        thread.join(10)
+        sink.stop()
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": vars(args),
+        **summarise(records, wall_seconds),
+        "openai_calls": fake_openai.calls,
+        "emails_delivered": sink.messages,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{result['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    latency = result["latency_seconds"]
+    print(f"{result['requests']} reviews, {result['errors']} errors, {result['throughput_rps']:.2f} req/s, "
+          f"p50 {latency.get('p50', 0):.2f}s p95 {latency.get('p95', 0):.2f}s, "
+          f"peak RSS {result['peak_rss_mb']['self']:.0f} MB")
+    for sample in result["error_samples"]:
+        print(f"  error: {sample}")
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(result, args.compare)
+
+if __name__ == "__main__":
+    main()
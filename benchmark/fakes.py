@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+import socketserver
+import threading
+import asyncio
+import random
+
+FAKE_REVIEW = """Claim #: {claim}
+VIN: 1HGCM82633A004352
+Vehicle: 2019 Honda Accord, mileage: 42,118 miles
+Compliance Score: 85%
+Total Loss Status: No
+
+Summary: Labor rates, tax and required photos reviewed. CCC Advisor Report included.
+"""
+
+class FakeCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def create(self, model=None, messages=None, max_tokens=None, stream=False, **kwargs):
+        owner = self._owner
+        owner.calls += 1
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in messages or [])
+        content = FAKE_REVIEW.format(claim=f"{owner.calls:06d}-000001-AB-01")
+        usage = SimpleNamespace(prompt_tokens=prompt_chars // 4, completion_tokens=len(content) // 4,
+                                total_tokens=prompt_chars // 4 + len(content) // 4)
+        if stream:
+            return owner._stream(content, usage)
+        await asyncio.sleep(owner.latency())
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=usage)
+
+class FakeAsyncOpenAI:
+    """Stand-in for openai.AsyncOpenAI: canned review text after a configurable, jittered delay."""
+
+    def __init__(self, latency_seconds: float = 2.0, jitter_seconds: float = 0.5, seed: int = 0):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self.chat = SimpleNamespace(completions=FakeCompletions(self))
+
+    def latency(self) -> float:
+        return max(0.0, self.latency_seconds + self._rng.uniform(-self.jitter_seconds, self.jitter_seconds))
+
+    async def _stream(self, content: str, usage):
+        words = content.split(" ")
+        delay = self.latency() / max(1, len(words))
+        for n, word in enumerate(words):
+            await asyncio.sleep(delay)
+            delta = SimpleNamespace(content=word if n == 0 else " " + word)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+class _SmtpSinkHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        self._reply("220 benchmark SMTP sink ready")
+        in_data = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if in_data:
+                if line in (b".\r\n", b".\n"):
+                    in_data = False
+                    self.server.messages += 1
+                    self._reply("250 OK: queued")
+                continue
+            command = line.decode("ascii", errors="ignore").strip().upper()
+            if command.startswith("EHLO"):
+                self.wfile.write(b"250-benchmark\r\n250 8BITMIME\r\n")
+            elif command.startswith("DATA"):
+                in_data = True
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+            elif command.startswith("QUIT"):
+                self._reply("221 Bye")
+                return
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP: accept everything
+                self._reply("250 OK")
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Minimal local SMTP server that accepts and counts every message without delivering it."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _SmtpSinkHandler)
+        self.messages = 0
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
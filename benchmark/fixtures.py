@@ -0,0 +1,99 @@
+from PIL import Image, ImageDraw
+from docx import Document
+from fpdf import FPDF
+from typing import List, Tuple
+import datetime
+import random
+import io
+
+ESTIMATE_LINES = [
+    "CCC ONE Estimate - Preliminary",
+    "Claim #: {claim}",
+    "Insured: Jane Sample   Policy #: PX-{seed:06d}   Date of Loss: 03/14/2025",
+    "VIN: 1HGCM82633A{seed:06d}",
+    "Vehicle: 2019 Honda Accord EX 4D SED   Mileage: 42,{seed3:03d} miles",
+    "Body Labor: $52.00/hr   Paint Labor: $52.00/hr   Mechanical Labor: $95.00/hr",
+    "Structural Labor: $60.00/hr",
+    "Line  Oper  Description                     Part Number      Qty  Price",
+    "1     Repl  Front Bumper Cover              04711-TVA-A00    1    412.55",
+    "2     R&I   Headlamp Assy LT                33150-TVA-A01    1    0.00",
+    "3     Rpr   Fender LT                                         1    0.00",
+    "4     Refn  Fender LT                                         1    0.00",
+    "Sales Tax $512.40 @ 6.2500% $32.03",
+    "CCC Advisor Report attached.",
+]
+
+def estimate_text(page: int, seed: int) -> List[str]:
+    claim = f"{seed:06d}-{page:06d}-AB-{seed % 100:02d}"
+    return [line.format(claim=claim, seed=seed, seed3=seed % 1000) for line in ESTIMATE_LINES]
+
+def text_layer_pdf(pages: int, seed: int = 1) -> bytes:
+    """Estimate PDF with an embedded text layer, like CCC/Mitchell/Audatex exports."""
+    pdf = FPDF()
+    pdf.set_font("Courier", size=9)
+    for page in range(1, pages + 1):
+        pdf.add_page()
+        for _ in range(3):
+            for line in estimate_text(page, seed):
+                pdf.cell(0, 5, txt=line, ln=True)
+    out = pdf.output(dest="S")
+    return out.encode("latin-1") if isinstance(out, str) else bytes(out)
+
+def scanned_pdf(pages: int, seed: int = 1, dpi: int = 150) -> bytes:
+    """Image-only estimate PDF (no text layer) that has to go through OCR."""
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    images = []
+    for page in range(1, pages + 1):
+        img = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(img)
+        y = dpi // 2
+        for _ in range(3):
+            for line in estimate_text(page, seed):
+                draw.text((dpi // 2, y), line, fill=0)
+                y += 22
+        images.append(img.convert("RGB"))
+    buffer = io.BytesIO()
+    images[0].save(buffer, format="PDF", save_all=True, append_images=images[1:], resolution=dpi)
+    return buffer.getvalue()
+
+def docx_file(paragraphs: int = 40, seed: int = 1) -> bytes:
+    doc = Document()
+    for n in range(paragraphs):
+        doc.add_paragraph(estimate_text(n + 1, seed)[n % len(ESTIMATE_LINES)])
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def photo(size: Tuple[int, int], seed: int, with_exif: bool = True) -> bytes:
+    """Synthetic vehicle photo: coloured blocks plus a text plate so OCR has something to read."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        x1, y1 = x0 + rng.randrange(size[0] // 3), y0 + rng.randrange(size[1] // 3)
+        draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+    draw.text((size[0] // 10, size[1] // 10), f"1HGCM82633A{seed:06d}  ODO 42,{seed % 1000:03d}", fill=(0, 0, 0))
+    exif = Image.Exif()
+    if with_exif:
+        exif[306] = datetime.datetime.now().strftime("%Y:%m:%d %H:%M:%S")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=92, exif=exif)
+    return buffer.getvalue()
+
+def claim_files(pdf_kind: str, pages: int, photos: int, photo_size: Tuple[int, int],
+                docx: bool, duplicate_photos: int, seed: int) -> List[Tuple[str, bytes, str]]:
+    """One claim's uploads as (filename, content, content type) tuples."""
+    files = []
+    if pdf_kind == "text":
+        files.append(("estimate.pdf", text_layer_pdf(pages, seed), "application/pdf"))
+    elif pdf_kind == "scanned":
+        files.append(("estimate.pdf", scanned_pdf(pages, seed), "application/pdf"))
+    if docx:
+        files.append(("supplement.docx", docx_file(seed=seed),
+                      "application/vnd.openxmlformats-officedocument.wordprocessingml.document"))
+    for n in range(photos):
+        # The last few photos repeat earlier ones to exercise near-duplicate removal
+        source = n - photos + duplicate_photos if n >= photos - duplicate_photos else n
+        files.append((f"photo_{n:02d}.jpg", photo(photo_size, seed * 1000 + max(0, source)), "image/jpeg"))
+    return files
@@ -0,0 +1,114 @@
+from PIL import Image
+from typing import List, Optional
+import threading
+import hashlib
+import metrics
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.environ.get("YOLO_MODEL_PATH", os.path.join(os.getcwd(), "corner-detector.pt"))
+BATCH_SIZE = int(os.environ.get("YOLO_BATCH_SIZE", "8"))
+NUM_THREADS = int(os.environ.get("YOLO_THREADS", str(os.cpu_count() or 1)))
+
+class CornerDetector:
+    """Process-wide YOLO corner detector. The model is built once and inference runs in batches on CPU."""
+
+    def __init__(self, model_path: str = MODEL_PATH, batch_size: int = BATCH_SIZE, num_threads: int = NUM_THREADS):
+        self.model_path = model_path
+        self.batch_size = max(1, batch_size)
+        self.num_threads = max(1, num_threads)
+        self._model = None
+        self._load_failed = False
+        self._loading = False
+        self._version = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def state(self) -> str:
+        """One of "not_loaded", "loading", "loaded" or "unavailable" (missing file or failed load)."""
+        if self._model is not None:
+            return "loaded"
+        if self._load_failed:
+            return "unavailable"
+        return "loading" if self._loading else "not_loaded"
+
+    @property
+    def version(self) -> Optional[str]:
+        """Content hash of the model file, so cached counts are tied to the weights that produced them."""
+        if self._version is None and os.path.exists(self.model_path):
+            digest = hashlib.sha256()
+            with open(self.model_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            self._version = digest.hexdigest()
+        return self._version
+
+    def load(self):
+        with self._lock:
+            if self._model is not None or self._load_failed:
+                return self._model
+            if not os.path.exists(self.model_path):
+                logger.error(f"YOLO model file not found at {self.model_path}")
+                self._load_failed = True
+                return None
+            self._loading = True
+            start = time.perf_counter()
+            try:
+                # torch and ultralytics take seconds to import, so they are only pulled in when the model is needed
+                os.environ["OPENCV_VIDEOIO_PRIORITY_MSMF"] = "0"  # Force headless mode
+                import torch
+                from ultralytics import YOLO
+                torch.set_num_threads(self.num_threads)
+                self._model = YOLO(self.model_path)
+                logger.info(f"YOLO corner detector loaded from {self.model_path} in {time.perf_counter() - start:.2f}s "
+                            f"(batch size {self.batch_size}, {self.num_threads} threads)")
+            except Exception as e:
+                logger.error(f"YOLO model load error: {str(e)}")
+                self._load_failed = True
+            finally:
+                self._loading = False
+            return self._model
+
+    def warm_up(self):
+        # One throwaway inference so the first real claim does not pay for lazy layer initialisation
+        if self.load() is None:
+            return
+        self.count_corners([Image.new("RGB", (640, 640))])
+        logger.info("YOLO corner detector warmed up")
+
+    @metrics.timed("yolo")
+    def count_corners(self, images: List[Image.Image]) -> List[int]:
+        counts = [0] * len(images)
+        model = self.load()
+        if model is None or not images:
+            return counts
+        for start in range(0, len(images), self.batch_size):
+            batch = [img.convert("RGB") for img in images[start:start + self.batch_size]]
+            try:
+                # The predictor keeps per-call state, so batches from concurrent requests are serialised
+                with self._lock:
+                    results = model(batch, device="cpu", verbose=False)
+            except Exception as e:
+                logger.error(f"YOLO detection error: {str(e)}")
+                continue  # Default to 0 for every image in a failed batch
+            for offset, result in enumerate(results):
+                boxes = result.boxes
+                # Count detected corners (assuming class 0 is corner)
+                counts[start + offset] = int((boxes.cls == 0).sum()) if boxes is not None and len(boxes) else 0
+        logger.debug(f"YOLO detected corner views per image: {counts}")
+        return counts
+
+_detector: Optional[CornerDetector] = None
+
+def get_detector() -> CornerDetector:
+    global _detector
+    if _detector is None:
+        _detector = CornerDetector()
+    return _detector
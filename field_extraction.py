@@ -0,0 +1,92 @@
+from collections import Counter
+from functools import lru_cache
+from typing import List, NamedTuple
+import metrics
+import re
+
+VIN_RE = re.compile(r"\b[A-HJ-NPR-Z0-9]{17}\b", re.IGNORECASE)
+MILEAGE_RE = re.compile(r"mileage:\s*(\d{1,6}(?:,\d{3})*(?:\s*miles|\s*km)?)")
+
+LABOR_SECTIONS = ("body labor", "paint labor", "mechanical labor", "structural labor")
+SUSPICIOUS_TERMS = ("fraud", "fake", "altered", "manipulated", "forged")
+NO_DAMAGE_PHRASES = ("no damage found", "no damage identified")
+ADVISOR_TERMS = ("ccc advisor report", "advisor report")
+TOTAL_LOSS_FIELDS = ("insured", "policy #", "claim #", "date of loss")
+
+class _Pattern(NamedTuple):
+    lower: re.Pattern  # Case-sensitive, for lowered text: keeps re's fast literal-prefix search
+    any_case: re.Pattern  # IGNORECASE fallback for text whose length changes when lowered
+
+def _pattern(source: str) -> _Pattern:
+    return _Pattern(re.compile(source), re.compile(source, re.IGNORECASE))
+
+LABOR_PATTERNS = {section: _pattern(rf"{section}[:\s]*(?:\$?\d+\.?\d*\s*(?:/hr|hour)?)") for section in LABOR_SECTIONS}
+# Any "sales tax ..." match contains one starting at "tax", so the optional prefix is left out of the search
+TAX_PATTERN = _pattern(r"tax(?:\s+tier\s+\d+)?\s*[:\s]*\$?\s*\d+\.?\d*\s*(?:@|\s+at\s+)\s*\d+\.?\d*%\s*\$?\s*\d+\.?\d*")
+CLAIM_PATTERN = _pattern(r"claim\s*(?:#?:\s*)?([0-9]{6}-[0-9]{6}-[a-z]{2}-[0-9]{2})")
+
+class ReviewFields(NamedTuple):
+    claim_number: str
+    vehicle: str  # With any "mileage: ..." part removed
+    mileage: str
+    compliance_score: str
+    total_loss: bool
+
+class EstimateFields(NamedTuple):
+    labor_sections: List[str]  # Labor rate sections present, in LABOR_SECTIONS order
+    has_tax_line: bool  # "Sales Tax $X @ Y% $Z" style line
+    claim_numbers: List[str]
+    suspicious_terms: List[str]
+    no_damage: bool
+    advisor_report: bool
+    total_loss_fields: List[str]  # TOTAL_LOSS_FIELDS present, in that order
+
+@lru_cache(maxsize=64)
+def _label_pattern(label: str) -> re.Pattern:
+    return re.compile(rf"{re.escape(label)}\s*[:\-#=]?\s*(R226\d+.*|[A-HJ-NPR-Z0-9]{{17}}|[^\n\r;]+)", re.IGNORECASE)
+
+def extract_field(label: str, text: str) -> str:
+    matches = _label_pattern(label).findall(text)
+    if matches:
+        return Counter(matches).most_common(1)[0][0].strip()
+    if label.lower() == "vin":
+        vin_match = VIN_RE.search(text)
+        return vin_match.group(0) if vin_match else "N/A"
+    return "N/A"
+
+def parse_review_output(gpt_output: str) -> ReviewFields:
+    """The fields the scorer and report need from the GPT review."""
+    vehicle = extract_field("Vehicle", gpt_output)
+    mileage_match = MILEAGE_RE.search(vehicle.lower())
+    if mileage_match:
+        vehicle = MILEAGE_RE.sub("", vehicle).strip()
+    return ReviewFields(
+        claim_number=extract_field("Claim", gpt_output),
+        vehicle=vehicle,
+        mileage=mileage_match.group(1) if mileage_match else "N/A",
+        compliance_score=extract_field("Compliance Score", gpt_output),
+        total_loss=extract_field("Total Loss Status", gpt_output).lower() == "yes",
+    )
+
+@metrics.timed("field_extraction")
+def extract_estimate_fields(text: str) -> EstimateFields:
+    """Everything the scorers, fraud check and prompt hints read from the estimate text.
+
+    The text is lowered once and every pattern is compiled once, instead of each check lowering and
+    rescanning the whole OCR dump with its own regex.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        haystack, variant = lowered, 0
+    else:
+        haystack, variant = text, 1
+    return EstimateFields(
+        labor_sections=[s for s in LABOR_SECTIONS if LABOR_PATTERNS[s][variant].search(haystack)],
+        has_tax_line=TAX_PATTERN[variant].search(haystack) is not None,
+        # Spans index the original text, so claim numbers keep their case
+        claim_numbers=[text[m.start(1):m.end(1)] for m in CLAIM_PATTERN[variant].finditer(haystack)],
+        suspicious_terms=[t for t in SUSPICIOUS_TERMS if t in lowered],
+        no_damage=any(p in lowered for p in NO_DAMAGE_PHRASES),
+        advisor_report=any(t in lowered for t in ADVISOR_TERMS),
+        total_loss_fields=[f for f in TOTAL_LOSS_FIELDS if f in lowered],
+    )
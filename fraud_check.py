@@ -1,43 +1,42 @@
-from PIL import Image
 import re
+import logging
 from datetime import datetime
-import io
+from field_extraction import extract_estimate_fields
+from image_forensics import ELA_ENABLED
+import metrics
+import os
 
-def calculate_fraud_risk(combined_text, image_files=None):
+logger = logging.getLogger(__name__)
+
+VALID_CLAIM_NUMBER = re.compile(r"^[0-9]{6}-[0-9]{6}-[A-Z]{2}-[0-9]{2}$")
+
+RASTER_USERS = ("phash", "document") + (("ela",) if ELA_ENABLED else ())
+# Added once per claim however many of its photos were seen before
+PHOTO_REUSE_SCORE = 25
+# JPEGs saved below this quality get a note. Phone cameras save at 85-97 and Pillow and most upload tools
+# re-encode at 75, so low quality alone says nothing about editing and is not scored.
+LOW_JPEG_QUALITY = int(os.environ.get("LOW_JPEG_QUALITY", "75"))
+
+@metrics.timed("fraud_images")
+def check_image_forensics(image_analyses, claim_id=None, photo_index=None):
+    """Image-only fraud indicators, independent of the estimate text so it can run alongside extraction.
+
+    With a claim_id and photo_index, each photo is also looked up among the photos of earlier claims
+    and then added to the index under claim_id; reuse is scored once per claim however many photos match.
+    Error level analysis and JPEG quality only add notes, which are shown in the report but not scored.
+    """
     score = 0
     flags = []
+    notes = []
+    reused = 0
     current_year = datetime.now().year  # 2025
 
-    # 1. Check for suspicious terms
-    suspicious_terms = ["fraud", "fake", "altered", "manipulated", "forged"]
-    if any(term in combined_text.lower() for term in suspicious_terms):
-        flags.append("Suspicious terms detected")
-        score += 15  # Reduced from 25 to calibrate severity
-
-    # 2. Claim number consistency
-    claim_pattern = r"claim\s*(?:#?:\s*)?([0-9]{6}-[0-9]{6}-[A-Z]{2}-[0-9]{2})"
-    claim_numbers = re.findall(claim_pattern, combined_text, re.IGNORECASE)
-    if claim_numbers:
-        valid_claims = [c for c in claim_numbers if re.match(r"^[0-9]{6}-[0-9]{6}-[A-Z]{2}-[0-9]{2}$", c)]
-        if valid_claims:
-            if len(valid_claims) > 1 and len(set(valid_claims)) > 1:
-                flags.append(f"Multiple inconsistent claim numbers detected: {', '.join(valid_claims)}")
-                score += 20  # Penalty for multiple different claims
-        else:
-            flags.append("No valid claim number format detected")
-            score += 10
-    else:
-        flags.append("No claim number found")
-        score += 10
-
-    # 3. Edited/Manipulated Image Indicators
-    if image_files:
-        for img in image_files:
+    # Edited/Manipulated Image Indicators
+    if image_analyses:
+        for analysis in image_analyses:
             try:
-                img.file.seek(0)
-                image = Image.open(io.BytesIO(img.file.read()))
-                # Check EXIF data for manipulation indicators
-                exif_data = image._getexif()
+                # Check EXIF data for manipulation indicators; reuses the metadata read alongside OCR
+                exif_data = analysis.exif
                 if exif_data:
                     exif_date = exif_data.get(36867) or exif_data.get(306)  # DateTimeOriginal or DateTime
                     if exif_date:
@@ -55,13 +54,77 @@ def calculate_fraud_risk(combined_text, image_files=None):
                 else:
                     flags.append("No EXIF data (possible manipulation)")
                     score += 15
-                # Basic manipulation check (e.g., high compression or metadata tampering)
-                if image.format == "JPEG" and image.info.get("quality", 95) < 80:
-                    flags.append("High compression detected (possible editing)")
-                    score += 15
+                quality = analysis.jpeg_quality
+                if analysis.format == "JPEG" and quality is not None and quality < LOW_JPEG_QUALITY:
+                    notes.append(f"High compression in {analysis.filename} (JPEG quality {quality})")
             except Exception as e:
                 flags.append(f"Image processing error: {str(e)}")
                 score += 10
+                continue
+            try:
+                ela = analysis.ela if ELA_ENABLED else None
+                if ela is not None and ela.suspicious:
+                    notes.append(f"Localized compression differences in {analysis.filename} "
+                                 f"({ela.anomalous_share:.1%} of its textured area)")
+                if photo_index is not None and claim_id:
+                    # Pages of one report template look alike to a perceptual hash, so documents must be exact copies
+                    if analysis.is_document:
+                        matches = photo_index.find_copies(analysis.content_hash, exclude_claim=claim_id)
+                    else:
+                        matches = photo_index.find(analysis.phash, exclude_claim=claim_id)
+                    if matches:
+                        flags.append(f"Photo {analysis.filename} was already submitted with claim {matches[0].claim}")
+                        reused += 1
+            except Exception as e:
+                logger.error(f"Image forensics error ({analysis.filename}): {str(e)}")
+
+        # Indexed only after the lookups, so photos repeated within this claim never match each other
+        if photo_index is not None and claim_id:
+            for analysis in image_analyses:
+                try:
+                    photo_index.add(analysis.phash, claim_id, analysis.filename, analysis.content_hash,
+                                    analysis.is_document)
+                except Exception as e:
+                    logger.error(f"Photo index error ({analysis.filename}): {str(e)}")
+        if reused:
+            score += PHOTO_REUSE_SCORE
+        metrics.count("reused_photos", reused)
+
+    return {"score": score, "flags": flags, "notes": notes}
+
+@metrics.timed("fraud_score")
+def calculate_fraud_risk(combined_text, image_analyses=None, image_findings=None, estimate_fields=None):
+    score = 0
+    flags = []
+    # Shared with the labor/tax scorer when called from the review pipeline
+    if estimate_fields is None:
+        estimate_fields = extract_estimate_fields(combined_text)
+
+    # 1. Check for suspicious terms
+    if estimate_fields.suspicious_terms:
+        flags.append("Suspicious terms detected")
+        score += 15  # Reduced from 25 to calibrate severity
+
+    # 2. Claim number consistency
+    claim_numbers = estimate_fields.claim_numbers
+    if claim_numbers:
+        valid_claims = [c for c in claim_numbers if VALID_CLAIM_NUMBER.match(c)]
+        if valid_claims:
+            if len(valid_claims) > 1 and len(set(valid_claims)) > 1:
+                flags.append(f"Multiple inconsistent claim numbers detected: {', '.join(valid_claims)}")
+                score += 20  # Penalty for multiple different claims
+        else:
+            flags.append("No valid claim number format detected")
+            score += 10
+    else:
+        flags.append("No claim number found")
+        score += 10
+
+    # 3. Edited/Manipulated Image Indicators (precomputed by check_image_forensics when run concurrently)
+    if image_findings is None:
+        image_findings = check_image_forensics(image_analyses)
+    flags.extend(image_findings["flags"])
+    score += image_findings["score"]
 
     # Cap score at 100%
     score = min(100, score)
@@ -69,4 +132,4 @@ def calculate_fraud_risk(combined_text, image_files=None):
     # Ensure explanation is always provided
     explanation = "No fraud indicators detected." if not flags else "\n".join(flags)
 
-    return {"score": score, "flags": flags, "explanation": explanation}
+    return {"score": score, "flags": flags, "explanation": explanation, "notes": image_findings.get("notes", [])}
@@ -0,0 +1,313 @@
+from PIL import Image, ImageEnhance, ImageOps, ImageFilter
+from image_forensics import ElaResult, error_level_analysis, estimate_jpeg_quality, looks_like_document, perceptual_hash
+from result_cache import content_hash
+from typing import Optional
+import pytesseract
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Values derived from the decoded raster; once all of them are known the raster is dropped
+RASTER_USERS = ("ocr", "corners", "dhash")
+
+def raster_bytes(image: Image.Image) -> int:
+    """Approximate memory of the decoded image (Pillow keeps multi-band pixels in 4 bytes) plus its grayscale copy."""
+    width, height = image.size
+    return width * height * (1 if image.mode in ("1", "L", "P") else 4) + width * height
+
+def preprocess_image(img: Image.Image) -> Image.Image:
+    img = img.convert("L")  # Convert to grayscale
+    img = ImageEnhance.Contrast(img).enhance(2.0)  # Enhance contrast
+    img = img.filter(ImageFilter.MedianFilter(size=3))  # Noise reduction
+    img = ImageOps.autocontrast(img)  # Adaptive thresholding
+    img = ImageOps.invert(img)  # Invert for better OCR
+    return img
+
+class AnalysisStats:
+    """Per-request counters: how often each stage actually ran and how long it took."""
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, elapsed: float):
+        with self._lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed
+
+    def summary(self) -> dict:
+        return {
+            stage: {"calls": self.calls[stage], "seconds": round(self.seconds[stage], 4)}
+            for stage in self.calls
+        }
+
+class ImageAnalysis:
+    """One uploaded photo, decoded once. Every derived value is computed on first access and kept.
+
+    OCR text, corner counts and metadata are also stored in the result cache under the photo's content
+    hash, so a resubmitted photo is not decoded at all. The decoded raster is registered with the
+    request's memory budget and dropped as soon as every value in raster_users has been derived.
+    """
+
+    # image_metadata_v2: quality is estimated from the quantization tables (v1 always held Pillow's default 95)
+    # image_ela_v2: texture-normalized comparison (v1 held a block ratio that text alone pushed over the threshold)
+    CACHED = {"ocr": "image_ocr", "corners": "image_corners", "metadata": "image_metadata_v2", "dhash": "image_dhash",
+              "ela": "image_ela_v2", "phash": "image_phash", "document": "image_document"}
+
+    def __init__(self, upload, stats: AnalysisStats, corner_detector=None, cache=None, budget=None,
+                 raster_users=RASTER_USERS):
+        self.filename = upload.filename
+        self._upload = upload
+        self._stats = stats
+        self._corner_detector = corner_detector
+        self._cache = cache
+        self._budget = budget
+        self._raster_users = raster_users
+        self._values = {}
+        self._errors = {}
+        # Stages run concurrently on the same photo; the lock makes each value compute exactly once
+        self._lock = threading.RLock()
+
+    def _lookup(self, key: str):
+        """(found, value) from memory or the result cache, without computing anything."""
+        with self._lock:
+            # One read: release_raster may pop decode/preprocess from another thread without this lock
+            value = self._values.get(key, _MISSING)
+            if value is not _MISSING:
+                return True, value
+            if key in self._errors:
+                return True, None
+            if self._cache is not None and key in self.CACHED:
+                value = self._cache.get(self.CACHED[key], self._cache_key(key), _MISSING)
+                if value is not _MISSING:
+                    self._values[key] = value
+                    return True, value
+            return False, None
+
+    def _get(self, key: str, compute):
+        with self._lock:
+            try:
+                found, value = self._lookup(key)
+                if key in self._errors:
+                    raise self._errors[key]
+                if found:
+                    return value
+                start = time.perf_counter()
+                try:
+                    value = compute()
+                except Exception as e:
+                    # Remember the failure so a broken upload is not decoded again by every consumer
+                    self._errors[key] = e
+                    raise
+                finally:
+                    self._stats.record(key, time.perf_counter() - start)
+                self._set(key, value)
+                return value
+            finally:
+                if key in self._raster_users:
+                    self._release_if_done()
+
+    def _set(self, key: str, value):
+        with self._lock:
+            self._values.setdefault(key, value)
+            if self._cache is not None and key in self.CACHED and self._persistable(key):
+                self._cache.set(self.CACHED[key], self._cache_key(key), value)
+            if key in self._raster_users:
+                self._release_if_done()
+
+    def derive(self, key: str, compute):
+        """Compute (once) and keep a value defined outside this class, such as the GPT-ready encoding."""
+        return self._get(key, compute)
+
+    def _release_if_done(self):
+        if all(k in self._values or k in self._errors for k in self._raster_users):
+            self.release_raster()
+
+    def release_raster(self):
+        # Also the budget's eviction callback, so it must not wait for this photo's lock
+        self._values.pop("decode", None)
+        self._values.pop("preprocess", None)
+        if self._budget is not None:
+            self._budget.release(self)
+
+    def _cache_key(self, key: str) -> str:
+        if key == "corners":
+            # Counts depend on the model, so swapping corner-detector.pt must not serve the old model's counts
+            version = self._corner_detector.version if self._corner_detector is not None else None
+            return content_hash(self.content_hash, version)
+        return self.content_hash
+
+    def _persistable(self, key: str) -> bool:
+        # Without a loaded model every photo reports 0 corners; that placeholder must not outlive this request
+        if key == "corners":
+            return self._corner_detector is not None and self._corner_detector.loaded
+        return True
+
+    def read_bytes(self) -> bytes:
+        return self._upload.read_bytes()
+
+    def _decode(self) -> Image.Image:
+        with self._upload.open() as f:
+            image = Image.open(f)
+            if self._budget is not None:
+                self._budget.hold(self, raster_bytes(image), self.release_raster, self.filename)
+            image.load()
+        return image
+
+    def _read_metadata(self) -> dict:
+        # Image.open parses the header, EXIF segment and quantization tables only; the pixels are never decoded
+        with self._upload.open() as f:
+            image = Image.open(f)
+            exif = image._getexif() if hasattr(image, "_getexif") else None
+            return {"format": image.format, "exif": exif,
+                    "quality": estimate_jpeg_quality(getattr(image, "quantization", None))}
+
+    def _dhash(self) -> int:
+        # 64-bit difference hash: brightness gradients of a 9x8 thumbnail, stable under resizing and re-encoding
+        small = self.image.convert("L").resize((9, 8), Image.LANCZOS)
+        pixels = list(small.getdata())
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                right = pixels[row * 9 + col + 1]
+                value = (value << 1) | (left > right)
+        return value
+
+    def _ela(self):
+        # Error level analysis only means something for JPEGs; other formats are not decoded for it
+        return error_level_analysis(self.image, self.jpeg_quality) if self.format == "JPEG" else None
+
+    def _phash(self) -> int:
+        return perceptual_hash(self.image, (self.exif or {}).get(274))  # 274: EXIF Orientation
+
+    def _is_document(self) -> bool:
+        return looks_like_document(self.image)
+
+    def _ocr(self) -> str:
+        text = pytesseract.image_to_string(self.processed, lang="eng")
+        logger.debug(f"Image OCR text ({self.filename}): {text[:200]}...")
+        return text
+
+    def _detect_corners(self) -> int:
+        if self._corner_detector is None:
+            return 0
+        return self._corner_detector.count_corners([self.processed])[0]
+
+    @property
+    def content_hash(self) -> str:
+        return self._upload.sha256  # Computed while the upload was spooled
+
+    @property
+    def size(self) -> int:
+        return self._upload.size
+
+    @property
+    def image(self) -> Image.Image:
+        return self._get("decode", self._decode)
+
+    @property
+    def processed(self) -> Image.Image:
+        return self._get("preprocess", lambda: preprocess_image(self.image))
+
+    @property
+    def ocr_text(self) -> str:
+        return self._get("ocr", self._ocr)
+
+    @property
+    def metadata(self) -> dict:
+        return self._get("metadata", self._read_metadata)
+
+    @property
+    def exif(self):
+        return self.metadata["exif"]
+
+    @property
+    def format(self) -> str:
+        return self.metadata["format"]
+
+    @property
+    def jpeg_quality(self) -> Optional[int]:
+        """Encoder quality estimated from the quantization tables; None for formats without them."""
+        return self.metadata["quality"]
+
+    @property
+    def dhash(self) -> int:
+        return self._get("dhash", self._dhash)
+
+    @property
+    def ela(self) -> Optional[ElaResult]:
+        return self._get("ela", self._ela)
+
+    @property
+    def phash(self) -> int:
+        return self._get("phash", self._phash)
+
+    @property
+    def is_document(self) -> bool:
+        """A scan or screenshot of a document rather than a photo of the vehicle."""
+        return self._get("document", self._is_document)
+
+    @property
+    def corner_count(self) -> int:
+        return self._get("corners", self._detect_corners)
+
+class ImageAnalysisSet:
+    """The photos of a single review request, shared by advisor detection, photo compliance and fraud scoring.
+
+    raster_users names every value the request's consumers derive from the decoded raster; each photo's
+    raster is dropped once all of them are known. Modules that read such values export theirs as
+    RASTER_USERS (image_prep, fraud_check) for the caller to combine.
+    """
+
+    def __init__(self, uploads, corner_detector=None, cache=None, budget=None, raster_users=RASTER_USERS):
+        self.stats = AnalysisStats()
+        self._corner_detector = corner_detector
+        self.items = [ImageAnalysis(u, self.stats, corner_detector, cache, budget, raster_users) for u in uploads]
+
+    def iter_with_corners(self):
+        """Iterate the photos with corner detection batched per chunk of the detector's batch size.
+
+        Detecting a chunk just before it is consumed keeps only that chunk's rasters alive, instead of
+        every photo's while one batch over the whole set runs.
+        """
+        size = getattr(self._corner_detector, "batch_size", None) or max(1, len(self.items))
+        for start in range(0, len(self.items), size):
+            chunk = self.items[start:start + size]
+            self.detect_corners(chunk)
+            yield from chunk
+
+    def detect_corners(self, items=None):
+        """Run corner detection for every photo (of items, default all) that still needs it as one batched call."""
+        if self._corner_detector is None:
+            return
+        pending = []
+        for item in self.items if items is None else items:
+            if item._lookup("corners")[0]:
+                continue
+            try:
+                pending.append((item, item.processed))
+            except Exception:
+                continue  # Undecodable photos surface their error when corner_count is read
+        if not pending:
+            return
+        start = time.perf_counter()
+        counts = self._corner_detector.count_corners([processed for _, processed in pending])
+        self.stats.record("corners", time.perf_counter() - start)
+        for (item, _), count in zip(pending, counts):
+            item._set("corners", count)
+
+    def close(self):
+        for item in self.items:
+            item.release_raster()
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
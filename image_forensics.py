@@ -0,0 +1,151 @@
+from PIL import Image
+from typing import NamedTuple, Optional
+import numpy as np
+import io
+import os
+
+# Error level analysis re-saves the photo at this quality and measures how much each region changes
+ELA_ENABLED = os.environ.get("ELA_ENABLED", "1") != "0"
+ELA_JPEG_QUALITY = int(os.environ.get("ELA_JPEG_QUALITY", "90"))
+ELA_BLOCK = 16
+# Only textured blocks are compared: at least this share of their pixels must carry some gradient, which
+# leaves out flat areas and the thin strokes of text and hard edges (VIN plates, odometers, estimates)
+ELA_TEXTURE_COVERAGE = 0.6
+ELA_TEXTURE_GRADIENT = 3  # Grey levels
+ELA_EDGE_GRADIENT = int(os.environ.get("ELA_EDGE_GRADIENT", "64"))  # Any steeper step marks a hard edge
+# Fewer textured blocks than this share of the photo leave nothing reliable to compare
+ELA_MIN_TEXTURED_SHARE = 0.1
+# A textured block is anomalous when it re-compresses with over twice the photo's median error for its
+# texture; the photo is suspicious once this share of its textured blocks is anomalous. Measured on
+# synthetic photos: clean ones (including text overlays, q70-98) stay at or below 0.9%, a pasted region
+# of 4% of the frame with a different compression history reaches 3-8%.
+ELA_ANOMALY_FACTOR = 2.0
+ELA_AREA_THRESHOLD = float(os.environ.get("ELA_AREA_THRESHOLD", "0.02"))
+# Block error (grey levels) below which differences are treated as plain re-encoding noise
+ELA_NOISE_FLOOR = 0.25
+
+# IJG reference luminance table (quality 50), in the natural order Pillow reports quantization tables
+_IJG_LUMINANCE = np.array([
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+], dtype=np.float64)
+
+# A photo that is mostly blank paper (light and colourless) with text spread over it is treated as a
+# document page or screenshot. Pages of one template (Advisor reports, estimates) hash alike whatever their
+# text, so documents are only matched as exact copies. Measured: report pages are 0.86 paper with text in
+# 13-57% of a 64x64 grid; photos reach 0.55 paper with half the frame sky, and a light, plain panel with
+# dark seams (which is mostly paper by colour) has "text" in under 3% of the grid.
+DOCUMENT_PAPER_SHARE = float(os.environ.get("DOCUMENT_PAPER_SHARE", "0.7"))
+DOCUMENT_TEXT_SHARE = float(os.environ.get("DOCUMENT_TEXT_SHARE", "0.05"))
+DOCUMENT_PAPER_LEVEL = 200  # Minimum grey level of paper
+DOCUMENT_PAPER_CHROMA = 24  # Maximum spread between colour channels of paper
+DOCUMENT_INK_LEVEL = 110  # Maximum grey level of printed text
+DOCUMENT_GRID = 64
+
+PHASH_SIZE = 32
+# Orthonormal DCT-II basis, so the 2-D transform of a 32x32 thumbnail is two matrix products
+_n = np.arange(PHASH_SIZE)
+_DCT = np.sqrt(2 / PHASH_SIZE) * np.cos(np.pi * (2 * _n[None, :] + 1) * _n[:, None] / (2 * PHASH_SIZE))
+_DCT[0] /= np.sqrt(2)
+
+# EXIF orientation -> transpose that shows the photo upright, as ImageOps.exif_transpose applies it
+_ORIENTATION = {2: Image.FLIP_LEFT_RIGHT, 3: Image.ROTATE_180, 4: Image.FLIP_TOP_BOTTOM, 5: Image.TRANSPOSE,
+                6: Image.ROTATE_270, 7: Image.TRANSVERSE, 8: Image.ROTATE_90}
+
+class ElaResult(NamedTuple):
+    mean_error: float  # Mean absolute difference per pixel after re-saving
+    textured_share: float  # Share of blocks textured enough to compare
+    anomalous_share: float  # Share of textured blocks re-compressing far worse than their texture explains
+    suspicious: bool
+
+def estimate_jpeg_quality(quantization) -> Optional[int]:
+    """Encoder quality (1-100) implied by a JPEG's luminance quantization table, read from the header.
+
+    Tables written by libjpeg-style encoders are the IJG reference table scaled by the quality setting,
+    so the mean ratio to the reference inverts that scaling. Returns None when the file has no tables.
+    """
+    if not quantization or 0 not in quantization or len(quantization[0]) != 64:
+        return None
+    scale = float(np.mean(np.asarray(quantization[0], dtype=np.float64) / _IJG_LUMINANCE)) * 100
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return int(round(min(100.0, max(1.0, quality))))
+
+def _blocks(values: np.ndarray) -> np.ndarray:
+    height = values.shape[0] - values.shape[0] % ELA_BLOCK
+    width = values.shape[1] - values.shape[1] % ELA_BLOCK
+    return values[:height, :width].reshape(height // ELA_BLOCK, ELA_BLOCK, width // ELA_BLOCK, ELA_BLOCK)
+
+def error_level_analysis(image: Image.Image, quality: Optional[int] = None) -> ElaResult:
+    """Re-save the photo as JPEG and compare it with itself, in ELA_BLOCK-pixel blocks.
+
+    Re-compression error grows with texture, so each textured block's error is compared with the
+    photo's median error per unit of gradient. A pasted or retouched region with a different
+    compression history shows up as a patch of blocks far above that median; text and hard edges
+    are never compared. A photo already saved at about the re-save quality is re-saved 5 lower,
+    since re-saving with the same tables changes almost nothing.
+    """
+    resave = ELA_JPEG_QUALITY
+    if quality is not None and abs(quality - resave) <= 2:
+        resave -= 5
+    gray = image.convert("L")
+    buffer = io.BytesIO()
+    gray.save(buffer, format="JPEG", quality=resave)
+    buffer.seek(0)
+    pixels = np.asarray(gray, dtype=np.int16)
+    diff = np.abs(pixels - np.asarray(Image.open(buffer), dtype=np.int16))
+    mean_error = float(diff.mean()) if diff.size else 0.0
+    gradient = np.abs(np.diff(pixels, axis=1, append=pixels[:, -1:]))
+    gradient += np.abs(np.diff(pixels, axis=0, append=pixels[-1:, :]))
+    del pixels
+    if not _blocks(diff).size:
+        return ElaResult(mean_error, 0.0, 0.0, False)
+    block_error = _blocks(diff).mean(axis=(1, 3), dtype=np.float32)
+    block_gradient = _blocks(gradient)
+    textured = (block_gradient > ELA_TEXTURE_GRADIENT).mean(axis=(1, 3)) >= ELA_TEXTURE_COVERAGE
+    textured &= block_gradient.max(axis=(1, 3)) <= ELA_EDGE_GRADIENT
+    texture = block_gradient.mean(axis=(1, 3), dtype=np.float32)[textured]
+    textured_share = float(textured.mean())
+    if textured_share < ELA_MIN_TEXTURED_SHARE:
+        return ElaResult(mean_error, round(textured_share, 3), 0.0, False)
+    error = block_error[textured]
+    expected = float(np.median(error / texture)) * ELA_ANOMALY_FACTOR * texture
+    anomalous = float(np.mean((error > expected) & (error > ELA_NOISE_FLOOR)))
+    return ElaResult(mean_error, round(textured_share, 3), round(anomalous, 4), anomalous >= ELA_AREA_THRESHOLD)
+
+def perceptual_hash(image: Image.Image, orientation: Optional[int] = None) -> int:
+    """64-bit DCT hash: the sign of the lowest 8x8 frequencies of a 32x32 grayscale thumbnail against
+    their median. Survives re-encoding, resizing and mild colour edits; the orientation tag is applied
+    so a copy saved upright by another app hashes the same."""
+    small = image.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS)
+    if orientation in _ORIENTATION:
+        small = small.transpose(_ORIENTATION[orientation])
+    pixels = np.asarray(small, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:8, :8].ravel()
+    bits = low > np.median(low)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def looks_like_document(image: Image.Image) -> bool:
+    """True for scans and screenshots of documents: mostly paper, with text spread across the page."""
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    scale = 256 / max(image.size)
+    small = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BOX)
+    pixels = np.asarray(small.convert("RGB"), dtype=np.int16)
+    paper = (pixels.mean(axis=-1) >= DOCUMENT_PAPER_LEVEL) & \
+            (pixels.max(axis=-1) - pixels.min(axis=-1) <= DOCUMENT_PAPER_CHROMA)
+    if np.mean(paper) < DOCUMENT_PAPER_SHARE:
+        return False
+    # Text strokes are a pixel or two wide, so they are found at full resolution: a grid cell holds text
+    # when it has both paper and ink in it
+    gray = np.asarray(image.convert("L"))
+    cell_h, cell_w = max(1, gray.shape[0] // DOCUMENT_GRID), max(1, gray.shape[1] // DOCUMENT_GRID)
+    rows, cols = gray.shape[0] // cell_h, gray.shape[1] // cell_w
+    cells = gray[:rows * cell_h, :cols * cell_w].reshape(rows, cell_h, cols, cell_w)
+    text = (cells.max(axis=(1, 3)) >= DOCUMENT_PAPER_LEVEL) & (cells.min(axis=(1, 3)) <= DOCUMENT_INK_LEVEL)
+    return bool(np.mean(text) >= DOCUMENT_TEXT_SHARE)
@@ -0,0 +1,126 @@
+from image_analysis import ImageAnalysisSet
+from result_cache import content_hash
+from PIL import Image, ImageOps
+from typing import List
+import logging
+import metrics
+import base64
+import math
+import io
+import os
+
+logger = logging.getLogger(__name__)
+
+GPT_IMAGE_MAX_EDGE = int(os.environ.get("GPT_IMAGE_MAX_EDGE", "1536"))
+GPT_IMAGE_JPEG_QUALITY = int(os.environ.get("GPT_IMAGE_JPEG_QUALITY", "85"))
+# Photos whose perceptual hashes differ by at most this many bits are sent once; -1 disables deduplication
+GPT_IMAGE_DEDUP_DISTANCE = int(os.environ.get("GPT_IMAGE_DEDUP_DISTANCE", "4"))
+# "high", "low", or "auto" (high for photos with readable text such as VIN plates and odometers, low otherwise)
+GPT_IMAGE_DETAIL = os.environ.get("GPT_IMAGE_DETAIL", "high").lower()
+AUTO_DETAIL_MIN_TEXT_CHARS = 20
+
+RASTER_USERS = ("gpt_image",) + (("dhash",) if GPT_IMAGE_DEDUP_DISTANCE >= 0 else ())
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """GPT-4o vision token cost: 85 base tokens plus 170 per 512px tile after OpenAI's own rescaling."""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def _encode(analysis) -> dict:
+    image = ImageOps.exif_transpose(analysis.image)
+    original_size = image.size
+    if max(image.size) > GPT_IMAGE_MAX_EDGE:
+        image = image.copy()
+        image.thumbnail((GPT_IMAGE_MAX_EDGE, GPT_IMAGE_MAX_EDGE), Image.LANCZOS)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=GPT_IMAGE_JPEG_QUALITY, optimize=True)
+    encoded = buffer.getvalue()
+    size = image.size
+    # A small JPEG can already be tighter than our re-encode; keep it as-is then
+    if analysis.format == "JPEG" and size == original_size and analysis.size <= len(encoded):
+        encoded = analysis.read_bytes()
+    return {
+        "b64": base64.b64encode(encoded).decode("utf-8"),
+        "original_bytes": 4 * math.ceil(analysis.size / 3),  # Base64 length of the upload as sent before
+        "original_size": original_size,
+        "size": size,
+    }
+
+def _prepared(analysis, cache) -> dict:
+    key = content_hash(analysis.content_hash, GPT_IMAGE_MAX_EDGE, GPT_IMAGE_JPEG_QUALITY)
+    prepared = cache.get("gpt_image", key) if cache is not None else None
+    if prepared is None:
+        prepared = _encode(analysis)
+        if cache is not None:
+            cache.set("gpt_image", key, prepared)
+    return prepared
+
+def _detail(analysis) -> str:
+    if GPT_IMAGE_DETAIL != "auto":
+        return GPT_IMAGE_DETAIL
+    try:
+        text_chars = sum(c.isalnum() for c in analysis.ocr_text)
+    except Exception:
+        return "high"
+    return "high" if text_chars >= AUTO_DETAIL_MIN_TEXT_CHARS else "low"
+
+@metrics.timed("image_prep")
+def prepare_images_for_gpt(image_analyses: ImageAnalysisSet, cache=None):
+    """Downscale, re-encode and deduplicate photos for the vision message.
+
+    Returns the image_url content parts and a report of the bytes and estimated tokens saved.
+    The full-resolution images stay on the analysis objects for local OCR and YOLO.
+    """
+    parts: List[dict] = []
+    kept_hashes = []
+    report = {"images_in": len(image_analyses), "images_sent": 0, "duplicates_removed": 0,
+              "bytes_original": 0, "bytes_sent": 0, "tokens_original_est": 0, "tokens_sent_est": 0}
+    for analysis in image_analyses:
+        try:
+            # Kept on the analysis, which drops its raster once this and the other raster users are done
+            prepared = analysis.derive("gpt_image", lambda: _prepared(analysis, cache))
+        except Exception as e:
+            # Undecodable upload: send the original bytes exactly as before
+            logger.error(f"Image preparation error ({analysis.filename}): {str(e)}")
+            b64 = base64.b64encode(analysis.read_bytes()).decode("utf-8")
+            parts.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}})
+            report["images_sent"] += 1
+            report["bytes_original"] += len(b64)
+            report["bytes_sent"] += len(b64)
+            continue
+        original_tokens = estimate_image_tokens(*prepared["original_size"])
+        report["bytes_original"] += prepared["original_bytes"]
+        report["tokens_original_est"] += original_tokens
+
+        if GPT_IMAGE_DEDUP_DISTANCE >= 0:
+            try:
+                dhash = analysis.dhash
+                if any(hamming_distance(dhash, kept) <= GPT_IMAGE_DEDUP_DISTANCE for kept in kept_hashes):
+                    report["duplicates_removed"] += 1
+                    logger.debug(f"Skipping near-duplicate photo {analysis.filename}")
+                    continue
+                kept_hashes.append(dhash)
+            except Exception as e:
+                logger.error(f"Perceptual hash error ({analysis.filename}): {str(e)}")
+
+        detail = _detail(analysis)
+        parts.append({"type": "image_url",
+                      "image_url": {"url": f"data:image/jpeg;base64,{prepared['b64']}", "detail": detail}})
+        report["images_sent"] += 1
+        report["bytes_sent"] += len(prepared["b64"])
+        report["tokens_sent_est"] += estimate_image_tokens(*prepared["size"], detail=detail)
+
+    report["bytes_saved"] = report["bytes_original"] - report["bytes_sent"]
+    report["tokens_saved_est"] = report["tokens_original_est"] - report["tokens_sent_est"]
+    logger.debug(f"Image preparation: {report}")
+    return parts, report
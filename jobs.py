@@ -0,0 +1,192 @@
+from typing import Awaitable, BinaryIO, Callable, List, Optional, Tuple
+import threading
+import asyncio
+import logging
+import sqlite3
+import shutil
+import json
+import time
+import uuid
+import os
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.db")
+JOB_FILES_DIR = os.environ.get("JOB_FILES_DIR", "job_files")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "5"))
+# A job still running after this many claims took the worker down each time (OOM on a huge PDF, say)
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+class JobStore:
+    """SQLite-backed review queue. Uploads are kept on disk until the job finishes, so queued work survives restarts."""
+
+    def __init__(self, db_path: str = JOB_DB_PATH, files_dir: str = JOB_FILES_DIR):
+        self.db_path = db_path
+        self.files_dir = files_dir
+        os.makedirs(files_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress TEXT NOT NULL DEFAULT '[]',
+                params TEXT NOT NULL,
+                files TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                pdf_path TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        columns = [row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "attempts" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def requeue_interrupted(self, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        # Jobs that were running when the process died go back to the front of the queue, unless they
+        # have already been claimed max_attempts times: then they are the likely cause and are failed
+        now = time.time()
+        error = json.dumps({"status_code": 500, "error": f"Review was interrupted {max_attempts} times; giving up."})
+        with self._lock:
+            failed = [row["id"] for row in self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? AND attempts >= ?", (RUNNING, max_attempts))]
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status = ? AND attempts >= ?",
+                (FAILED, error, now, RUNNING, max_attempts))
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?", (QUEUED, now, RUNNING))
+        for job_id in failed:
+            logger.error(f"Job {job_id} was interrupted {max_attempts} times; marked failed")
+            self._remove_files(job_id)
+        if cursor.rowcount:
+            logger.info(f"Requeued {cursor.rowcount} interrupted review jobs")
+        return cursor.rowcount
+
+    def enqueue(self, params: dict, files: List[Tuple[str, BinaryIO]]) -> str:
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.files_dir, job_id)
+        os.makedirs(job_dir)
+        stored = []
+        for index, (filename, source) in enumerate(files):
+            # Prefix with the upload position so duplicate names do not collide and order is preserved
+            path = os.path.join(job_dir, f"{index:03d}_{os.path.basename(filename)}")
+            with open(path, "wb") as f:
+                shutil.copyfileobj(source, f, 1024 * 1024)
+            stored.append({"filename": filename, "path": path})
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, params, files, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), json.dumps(stored), now, now))
+        return job_id
+
+    def claim_next(self) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, "started", time.time(), row["id"]))
+        return self._to_dict(row, status=RUNNING, attempts=row["attempts"] + 1)
+
+    def record_progress(self, job_id: str, stage: str, data: Optional[dict] = None):
+        with self._lock:
+            row = self._conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            progress = json.loads(row["progress"])
+            progress.append({"stage": stage, "at": time.time(), **(data or {})})
+            self._conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ?",
+                (stage, json.dumps(progress), time.time(), job_id))
+
+    def complete(self, job_id: str, result: dict, pdf_path: Optional[str]):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, result = ?, pdf_path = ?, updated_at = ? WHERE id = ?",
+                (DONE, "done", json.dumps(result), pdf_path, time.time(), job_id))
+        self._remove_files(job_id)
+
+    def fail(self, job_id: str, error: dict):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (FAILED, json.dumps(error), time.time(), job_id))
+        self._remove_files(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def _remove_files(self, job_id: str):
+        shutil.rmtree(os.path.join(self.files_dir, job_id), ignore_errors=True)
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row, **overrides) -> dict:
+        job = dict(row)
+        for key in ("progress", "params", "files", "result", "error"):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        job.update(overrides)
+        return job
+
+class JobWorkers:
+    """Fixed-size pool of asyncio workers that drain the job store."""
+
+    def __init__(self, store: JobStore, handler: Callable[[dict], Awaitable[None]], concurrency: int = JOB_WORKERS):
+        self.store = store
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self._wakeup = None
+        self._tasks = []
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self.store.requeue_interrupted()
+        self._tasks = [asyncio.create_task(self._work(n)) for n in range(self.concurrency)]
+        logger.info(f"Started {self.concurrency} review job workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _work(self, worker_number: int):
+        while True:
+            job = await asyncio.to_thread(self.store.claim_next)
+            if job is None:
+                # Sleep until a new submission arrives, polling occasionally as a fallback
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            logger.debug(f"Worker {worker_number} picked up job {job['id']}")
+            try:
+                await self.handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} failed: {str(e)}")
+                await asyncio.to_thread(self.store.fail, job["id"], {"error": str(e)})
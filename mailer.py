@@ -0,0 +1,215 @@
+from email.message import EmailMessage
+from email import policy
+from email.parser import BytesParser
+from typing import Callable, Dict, Optional
+import threading
+import smtplib
+import logging
+import time
+import uuid
+import metrics
+import os
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "mail.tierra.net")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "465"))
+SMTP_USER = os.environ.get("SMTP_USER", "info@nspxn.com")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")  # Required whenever SMTP_USER is set
+SMTP_SSL = os.environ.get("SMTP_SSL", "1") != "0"  # Set to 0 for a plain local stand-in such as aiosmtpd
+MAIL_OUTBOX_DIR = os.environ.get("MAIL_OUTBOX_DIR", "mail_outbox")
+MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", "8"))
+MAIL_BACKOFF_SECONDS = float(os.environ.get("MAIL_BACKOFF_SECONDS", "5"))
+MAIL_MAX_BACKOFF_SECONDS = float(os.environ.get("MAIL_MAX_BACKOFF_SECONDS", "600"))
+MAIL_IDLE_SECONDS = float(os.environ.get("MAIL_IDLE_SECONDS", "60"))
+
+def smtp_connect() -> smtplib.SMTP:
+    if SMTP_USER and not SMTP_PASSWORD:
+        raise RuntimeError(f"SMTP_PASSWORD must be set to send mail as {SMTP_USER}")
+    if SMTP_SSL:
+        smtp = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=30)
+    else:
+        smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+    if SMTP_USER:
+        smtp.login(SMTP_USER, SMTP_PASSWORD)
+    return smtp
+
+class Mailer:
+    """Outbound mail: messages are persisted to an outbox directory and delivered by a background thread
+    over one reused, authenticated SMTP connection, in batches, with exponential backoff on failure.
+    Mail still in the outbox at shutdown is sent on the next start.
+    """
+
+    def __init__(self, outbox_dir: str = MAIL_OUTBOX_DIR, connect: Callable[[], smtplib.SMTP] = smtp_connect,
+                 batch_size: int = MAIL_BATCH_SIZE, max_attempts: int = MAIL_MAX_ATTEMPTS):
+        self.outbox_dir = outbox_dir
+        self.failed_dir = os.path.join(outbox_dir, "failed")
+        os.makedirs(self.failed_dir, exist_ok=True)
+        self.connect = connect
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max(1, max_attempts)
+        self.sent = 0
+        self.failed = 0
+        self._attempts: Dict[str, int] = {}
+        self._not_before: Dict[str, float] = {}
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, msg: EmailMessage) -> str:
+        name = f"{time.time():.6f}_{uuid.uuid4().hex}.eml"
+        tmp_path = os.path.join(self.outbox_dir, name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(msg.as_bytes(policy=policy.SMTP))
+        # Rename last so the sender never picks up a half-written message
+        os.replace(tmp_path, os.path.join(self.outbox_dir, name))
+        with self._wakeup:
+            self._wakeup.notify()
+        logger.debug(f"Queued email {name}: {msg['Subject']}")
+        return name
+
+    def pending(self) -> int:
+        return len(self._ready(float("inf")))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="mailer", daemon=True)
+        self._thread.start()
+        logger.info(f"Mailer started with {self.pending()} message(s) in the outbox")
+
+    def stop(self, timeout: float = 10):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _ready(self, now: float):
+        names = sorted(n for n in os.listdir(self.outbox_dir) if n.endswith(".eml"))
+        return [n for n in names if self._not_before.get(n, 0) <= now]
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    break
+            batch = self._ready(time.time())[:self.batch_size]
+            if batch:
+                try:
+                    self._send_batch(batch)
+                    continue
+                except Exception as e:
+                    # Never let one bad pass kill the sender; the outbox is retried after a pause
+                    logger.error(f"Mail sender error: {str(e)}")
+                    self._disconnect()
+                    with self._wakeup:
+                        if not self._stopping:
+                            self._wakeup.wait(timeout=MAIL_BACKOFF_SECONDS)
+                    continue
+            if self._smtp is not None and time.time() - self._last_used > MAIL_IDLE_SECONDS:
+                self._disconnect()
+            with self._wakeup:
+                if not self._stopping:
+                    self._wakeup.wait(timeout=self._next_wait())
+        self._disconnect()
+
+    def _next_wait(self) -> float:
+        if not self._not_before:
+            return MAIL_IDLE_SECONDS
+        return max(0.1, min(self._not_before.values()) - time.time())
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                # Cheap liveness check; servers drop idle connections
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._disconnect()
+        self._smtp = self.connect()
+        return self._smtp
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+    def _send_batch(self, names):
+        with metrics.stage_timer("smtp"):
+            self._send_batch_now(names)
+
+    def _send_batch_now(self, names):
+        try:
+            smtp = self._connection()
+        except Exception as e:
+            logger.error(f"SMTP connection error: {str(e)}")
+            for name in names:
+                self._retry_later(name, e)
+            return
+        for name in names:
+            path = os.path.join(self.outbox_dir, name)
+            try:
+                with open(path, "rb") as f:
+                    msg = BytesParser(policy=policy.SMTP).parse(f)
+                smtp.send_message(msg)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+                # The server rejected this message itself; retrying will not help
+                logger.error(f"Email {name} rejected: {str(e)}")
+                self._give_up(name)
+                continue
+            except Exception as e:
+                logger.error(f"Email {name} send error: {str(e)}")
+                self._disconnect()
+                self._retry_later(name, e)
+                # The connection is gone; back off the rest of the batch too
+                retry_at = self._not_before.get(name, time.time() + MAIL_BACKOFF_SECONDS)
+                for remaining in names[names.index(name) + 1:]:
+                    self._not_before[remaining] = retry_at
+                return
+            os.remove(path)
+            self._attempts.pop(name, None)
+            self._not_before.pop(name, None)
+            self.sent += 1
+            metrics.EMAILS.inc(outcome="sent")
+            self._last_used = time.time()
+        logger.debug(f"Sent {len(names)} queued email(s)")
+
+    def _retry_later(self, name: str, error: Exception):
+        attempts = self._attempts.get(name, 0) + 1
+        self._attempts[name] = attempts
+        if attempts >= self.max_attempts:
+            logger.error(f"Giving up on email {name} after {attempts} attempts: {str(error)}")
+            self._give_up(name)
+            return
+        delay = min(MAIL_MAX_BACKOFF_SECONDS, MAIL_BACKOFF_SECONDS * 2 ** (attempts - 1))
+        self._not_before[name] = time.time() + delay
+
+    def _give_up(self, name: str):
+        os.replace(os.path.join(self.outbox_dir, name), os.path.join(self.failed_dir, name))
+        self._attempts.pop(name, None)
+        self._not_before.pop(name, None)
+        self.failed += 1
+        metrics.EMAILS.inc(outcome="failed")
+
+    def stats(self) -> dict:
+        return {"pending": self.pending(), "sent": self.sent, "failed": self.failed,
+                "connected": self._smtp is not None}
+
+_mailer: Optional[Mailer] = None
+
+def get_mailer() -> Mailer:
+    global _mailer
+    if _mailer is None:
+        _mailer = Mailer()
+    return _mailer
@@ -1,32 +1,82 @@
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse, FileResponse
+import time
+IMPORT_STARTED = time.perf_counter()  # Taken before anything else is imported to measure import cost
+
+from fastapi import FastAPI, File, UploadFile, Form, Request
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import quote
 import os
 import re
-import base64
-import io
-import smtplib
+import asyncio
+import json
+import threading
+import shutil
 from email.message import EmailMessage
-from fpdf import FPDF
 from docx import Document
-from pdf2image import convert_from_bytes
-import pytesseract
-from PIL import Image, ImageEnhance, ImageOps, ImageFilter
-from openai import OpenAI
 import logging
-from ultralytics import YOLO
-import torch
-from fraud_check import calculate_fraud_risk
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import metrics
+from batch import (BATCH_DIR, BATCH_WORKERS, RUNNING as BATCH_RUNNING, WAITING_OPENAI, BatchClaim, BatchError,
+                   BatchRun, claims_from_archive, claims_from_manifest, last_record)
+from corner_detector import get_detector
+from field_extraction import TOTAL_LOSS_FIELDS, EstimateFields, extract_estimate_fields, parse_review_output
+from fraud_check import RASTER_USERS as FRAUD_RASTER_USERS, calculate_fraud_risk, check_image_forensics
+from image_analysis import ImageAnalysisSet
+from image_prep import RASTER_USERS as GPT_RASTER_USERS, prepare_images_for_gpt
+from pdf_ocr import extract_pdf_pages
+from photo_index import get_photo_index
+from reports import StoredReport, get_report_store, render_report
+from stages import run_stage, tenant_slot
+from jobs import DONE, FAILED, JobStore, JobWorkers
+from mailer import get_mailer
+from openai_batch import OPENAI_BATCH_MIN_REQUESTS, BatchRequestWriter, run_batch
+from result_cache import content_hash, get_cache
+from rules_registry import ClientRules, get_registry, parse_rules
+from uploads import MemoryBudget, RequestTooLarge, SpooledUpload, adopt_uploads
+
+IMPORT_SECONDS = round(time.perf_counter() - IMPORT_STARTED, 3)
+metrics.STARTUP_SECONDS.set(IMPORT_SECONDS, phase="import")
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, filename='app.log', filemode='a',
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging; records are written to app.log by a listener thread so request paths never block on disk
+log_queue = queue.SimpleQueue()
+log_file_handler = logging.FileHandler('app.log', mode='a')
+log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+logging.basicConfig(level=logging.DEBUG, handlers=[QueueHandler(log_queue)])
+log_listener = QueueListener(log_queue, log_file_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 if "OPENAI_API_KEY" not in os.environ:
-    raise RuntimeError("\u274c OPENAI_API_KEY environment variable is NOT set.")
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    logger.error("\u274c OPENAI_API_KEY environment variable is NOT set; reviews will fail until it is.")
+
+# "background" loads YOLO and the OpenAI SDK after the server is accepting connections, "blocking" finishes
+# that before startup completes, "lazy" defers both to the first review that needs them
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "background").lower()
+
+# Created on first use: importing the OpenAI SDK alone takes about half a second
+client = None
+client_lock = threading.Lock()
+warmup_state = {"status": "pending", "seconds": None}
+
+def get_openai_client():
+    global client
+    with client_lock:
+        if client is None:
+            if "OPENAI_API_KEY" not in os.environ:
+                raise RuntimeError("\u274c OPENAI_API_KEY environment variable is NOT set.")
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+        return client
+
+GPT_MODEL = "gpt-4o"
+GPT_MAX_TOKENS = 3500
+
+# Seconds between SSE comment lines on /vision-review/stream, so proxies keep a quiet stream open
+SSE_KEEPALIVE_SECONDS = float(os.environ.get("SSE_KEEPALIVE_SECONDS", "15"))
 
 app = FastAPI()
 
@@ -44,85 +94,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def preprocess_image(img: Image.Image) -> Image.Image:
-    img = img.convert("L")  # Convert to grayscale
-    img = ImageEnhance.Contrast(img).enhance(2.0)  # Enhance contrast
-    img = img.filter(ImageFilter.MedianFilter(size=3))  # Noise reduction
-    img = ImageOps.autocontrast(img)  # Adaptive thresholding
-    img = ImageOps.invert(img)  # Invert for better OCR
-    return img
-
-def extract_text_from_pdf(file) -> str:
+@metrics.timed("pdf_text")
+def extract_text_from_pdf(pdf_path: str) -> str:
     try:
-        file.seek(0)
-        images = convert_from_bytes(file.read(), dpi=150)  # Stable DPI
+        # Pages with an embedded text layer are read directly; only scanned pages go to the OCR pool
         text_output = ""
-        for i, img in enumerate(images, 1):
-            processed = preprocess_image(img)
-            try:
-                ocr_text = pytesseract.image_to_string(processed, lang="eng", config='--psm 3', timeout=30)
-            except Exception as e:
-                logger.warning(f"PSM 3 failed on page {i}: {str(e)}")
-                ocr_text = pytesseract.image_to_string(processed, lang="eng", config='--psm 6', timeout=30)
-            if ocr_text.strip() and not re.search(r"[\:/\d\s]{50,}", ocr_text):
-                text_output += f"\n[Page {i}]\n{ocr_text.strip()}"
-                logger.debug(f"Page {i} OCR text: {ocr_text[:200]}...")
+        for i, page_text, method in extract_pdf_pages(pdf_path):
+            metrics.PDF_PAGES.inc(method=method)
+            metrics.count(f"pdf_pages_{method}")
+            if page_text:
+                text_output += f"\n[Page {i}]\n{page_text}"
+                logger.debug(f"Page {i} {method} text: {page_text[:200]}...")
         if not text_output.strip():
             logger.error("No valid text extracted from PDF")
             return "\n\u274c No valid text extracted from PDF"
         return text_output
     except Exception as e:
         logger.error(f"PDF processing error: {str(e)}")
-        return "\n\u274c PDF processing error: {str(e)}"
+        return f"\n\u274c PDF processing error: {str(e)}"
 
+@metrics.timed("docx_text")
 def extract_text_from_docx(file) -> str:
     doc = Document(file)
     return '\n'.join(p.text.strip() for p in doc.paragraphs if p.text.strip())
 
-def extract_field(label: str, text: str) -> str:
-    pattern = re.compile(rf"{re.escape(label)}\s*[:\-#=]?\s*(R226\d+.*|[A-HJ-NPR-Z0-9]{{17}}|[^\n\r;]+)", re.IGNORECASE)
-    matches = pattern.findall(text)
-    if matches:
-        from collections import Counter
-        return Counter(matches).most_common(1)[0][0].strip()
-    if label.lower() == "vin":
-        vin_match = re.search(r"\b[A-HJ-NPR-Z0-9]{17}\b", text, re.IGNORECASE)
-        return vin_match.group(0) if vin_match else "N/A"
-    return "N/A"
-
-def detect_corners_with_yolo(image: Image.Image) -> int:
-    # Load YOLO model from local file
-    try:
-        model_path = os.path.join(os.getcwd(), "corner-detector.pt")
-        if not os.path.exists(model_path):
-            logger.error(f"YOLO model file not found at {model_path}")
-            return 0
-        model = YOLO(model_path)
-        # Convert PIL image to RGB and ensure numpy compatibility
-        image_rgb = image.convert("RGB")
-        # Perform inference in headless mode
-        os.environ["OPENCV_VIDEOIO_PRIORITY_MSMF"] = "0"  # Force headless mode
-        results = model(image_rgb)
-        # Count detected corners (assuming class 0 is corner)
-        corner_count = len([box for box in results[0].boxes if box.cls[0] == 0]) if results[0].boxes else 0
-        logger.debug(f"YOLO detected {corner_count} corner views")
-        return corner_count
-    except Exception as e:
-        logger.error(f"YOLO detection error: {str(e)}")
-        return 0  # Default to 0 if detection fails
-
-def check_required_photos(image_files: List[UploadFile]) -> tuple[List[str], float]:
+@metrics.timed("photo_compliance")
+def check_required_photos(image_analyses: ImageAnalysisSet) -> tuple[List[str], float]:
     required_photos = ["four corners", "odometer", "vin", "license plate"]
     found_photos = []
     total_deduction = 0
 
-    for img in image_files:
+    # One batched YOLO call per chunk of photos; each chunk is checked before the next is decoded
+    for analysis in image_analyses.iter_with_corners():
         try:
-            img.file.seek(0)
-            image = Image.open(io.BytesIO(img.file.read()))
-            processed = preprocess_image(image)
-            ocr_text = pytesseract.image_to_string(processed, lang="eng")
-            logger.debug(f"Image OCR text: {ocr_text[:200]}...")
+            ocr_text = analysis.ocr_text
 
             # VIN detection
             if re.search(r"\b[A-HJ-NPR-Z0-9]{17}\b", ocr_text):
@@ -140,7 +145,7 @@ def check_required_photos(image_files: List[UploadFile]) -> tuple[List[str], flo
                 logger.debug("Detected license plate in image")
 
             # Four corners detection using YOLO only
-            corner_count = detect_corners_with_yolo(processed)
+            corner_count = analysis.corner_count
             if corner_count >= 2:
                 found_photos.append("four corners")
                 logger.debug("Detected 2+ corner views with YOLO")
@@ -164,90 +169,427 @@ def check_required_photos(image_files: List[UploadFile]) -> tuple[List[str], flo
     logger.debug(f"Found photos: {found_photos}, Missing photos: {missing}, Total deduction: {total_deduction}%")
     return missing, total_deduction
 
-def check_labor_and_tax_score(text: str, client_rules: str, skip_labor_tax_checks: bool) -> int:
+def check_labor_and_tax_score(fields: EstimateFields, client_rules: ClientRules, skip_labor_tax_checks: bool) -> int:
     if skip_labor_tax_checks:
         logger.debug("Skipping labor and tax checks due to no damage found")
         return 0
     score_adj = 0
-    required_sections = ["body labor", "paint labor", "mechanical labor", "structural labor"]
-    found_sections = []
-    for section in required_sections:
-        if re.search(rf"{section}[:\s]*(?:\$?\d+\.?\d*\s*(?:/hr|hour)?)", text, re.IGNORECASE):
-            found_sections.append(section)
-    if not found_sections:
+    if not fields.labor_sections:
         score_adj -= 50
-    if re.search(r"utilize applicable tax rate", client_rules, re.IGNORECASE):
-        tax_pattern = r"(?:sales\s+)?tax(?:\s+tier\s+\d+)?\s*[:\s]*\$?\s*\d+\.?\d*\s*(?:@|\s+at\s+)\s*\d+\.?\d*%\s*\$?\s*\d+\.?\d*"
-        if re.search(tax_pattern, text.lower()):
+    if client_rules.requires_tax_rate:
+        if fields.has_tax_line:
             logger.debug("Tax information detected, no deduction applied")
         else:
             score_adj -= 25
     return score_adj
 
-def advisor_report_present(texts: List[str], image_files: List[UploadFile]) -> bool:
-    for t in texts:
-        if any(term in t.lower() for term in ["ccc advisor report", "advisor report"]):
-            return True
-    for img in image_files:
+@metrics.timed("advisor_detection")
+def advisor_report_in_photos(image_analyses: ImageAnalysisSet) -> bool:
+    for analysis in image_analyses:
         try:
-            img.file.seek(0)
-            image = Image.open(io.BytesIO(img.file.read()))
-            processed = preprocess_image(image)
-            ocr = pytesseract.image_to_string(processed, lang="eng")
-            if "advisor report" in ocr.lower():
+            if "advisor report" in analysis.ocr_text.lower():
                 return True
         except Exception as e:
             logger.error(f"Image OCR error: {str(e)}")
     return False
 
+@metrics.timed("report_pdf")
+def render_report_pdf(file_number: str, ia_company: str, appraiser_id: str, fraud_result: dict,
+                      total_loss_status: bool, gpt_output: str) -> StoredReport:
+    pdf = render_report(file_number, ia_company, appraiser_id, fraud_result, total_loss_status, gpt_output)
+    return report_store.save(file_number, pdf)
+
+def report_url(report: StoredReport) -> str:
+    return f"/download-pdf?file_number={quote(report.file_number)}&version={report.version}"
+
+@metrics.timed("email_enqueue")
+def send_batch_summary_email(run: BatchRun, rows: List[dict]):
+    """One message for a whole batch in place of a report email per claim; the full per-claim results
+    (including each AI review) are attached as JSONL."""
+    msg = EmailMessage()
+    msg["Subject"] = f"AI-4-IA Batch Review: {run.total} claims ({run.failed} failed)"
+    msg["From"] = "noreply@nspxn.com"
+    msg["To"] = "info@nspxn.com"
+    lines = []
+    for row in rows:
+        if row["status"] == "done":
+            lines.append(f"{row['file_number']}  {row['ia_company']}  Appraiser {row['appraiser_id']}  "
+                         f"Claim {row['claim_number']}  Score {row['score']}  Fraud Risk {row['fraud_score']}")
+        else:
+            lines.append(f"{row['file_number']}  {row['ia_company']}  Appraiser {row['appraiser_id']}  "
+                         f"FAILED: {row.get('error', 'unknown error')}")
+    email_body = f"""NSPXN.com AI4IA Batch Review Report
+
+Batch: {run.id}
+Claims: {run.total}
+Succeeded: {run.succeeded}
+Failed: {run.failed}
+
+""" + "\n".join(lines) + "\n"
+    msg.set_content(email_body.encode("utf-8", errors="ignore").decode("utf-8"))
+    with open(run.results_path, "rb") as f:
+        msg.add_attachment(f.read(), maintype="application", subtype="x-ndjson", filename=f"batch_{run.id}.jsonl")
+    mailer.enqueue(msg)
+
+@metrics.timed("email_enqueue")
+def send_report_email(file_number: str, ia_company: str, appraiser_id: str, claim_number: str,
+                      final_score: int, fraud_result: dict, gpt_output: str):
+    msg = EmailMessage()
+    msg["Subject"] = f"AI-4-IA Review: {claim_number or 'N/A'}"
+    msg["From"] = "noreply@nspxn.com"
+    msg["To"] = "info@nspxn.com"
+    email_body = f"""NSPXN.com AI4IA Review Report
+
+File Number: {file_number}
+IA Company: {ia_company}
+Appraiser ID #: {appraiser_id}
+Adjusted Compliance Score: {final_score}%
+Fraud Risk Score: {fraud_result['score']}%
+
+AI Review Summary:
+{gpt_output}
+"""
+    msg.set_content(email_body.encode("utf-8", errors="ignore").decode("utf-8"))
+    # Delivered by the background mailer; the review does not wait on SMTP
+    mailer.enqueue(msg)
+
+async def extract_upload_text(upload: SpooledUpload) -> str:
+    name = upload.filename.lower()
+    if name.endswith(".pdf"):
+        key = content_hash(upload.sha256)
+        text = await asyncio.to_thread(result_cache.get, "pdf_text", key)
+        if text is None:
+            # poppler reads the spooled file from disk; the PDF is never held in memory as bytes
+            text = await run_stage("pdf_text", extract_text_from_pdf, await asyncio.to_thread(upload.path))
+            if "\u274c" not in text:
+                await asyncio.to_thread(result_cache.set, "pdf_text", key, text)
+        if "\u274c" not in text:
+            logger.debug(f"Extracted text from PDF: {text[:200]}...")
+        return text
+    if name.endswith(".docx"):
+        key = content_hash(upload.sha256)
+        text = await asyncio.to_thread(result_cache.get, "docx_text", key)
+        if text is None:
+            text = await run_stage("docx_text", read_docx_upload, upload)
+            await asyncio.to_thread(result_cache.set, "docx_text", key, text)
+        return text
+    if name.endswith(".txt"):
+        return upload.read_bytes().decode("utf-8", errors="ignore")
+    return f"\u26a0\ufe0f Skipped unsupported file: {upload.filename}"
+
+def read_docx_upload(upload: SpooledUpload) -> str:
+    with upload.open() as f:
+        return extract_text_from_docx(f)
+
+class ReviewError(Exception):
+    """A review that cannot proceed; carries the HTTP status and JSON body to report."""
+
+    def __init__(self, status_code: int, content: dict):
+        super().__init__(content.get("error", ""))
+        self.status_code = status_code
+        self.content = content
+
+@app.on_event("startup")
+def load_client_rules():
+    rules_registry.refresh(force=True)
+
+def warm_up_models():
+    warmup_state["status"] = "running"
+    start = time.perf_counter()
+    get_detector().warm_up()
+    try:
+        get_openai_client()
+    except Exception as e:
+        logger.error(f"OpenAI client setup error: {str(e)}")
+    warmup_state["seconds"] = round(time.perf_counter() - start, 3)
+    warmup_state["status"] = "done"
+    metrics.STARTUP_SECONDS.set(warmup_state["seconds"], phase="warmup")
+    logger.info(f"Model warm-up finished in {warmup_state['seconds']}s (detector {get_detector().state})")
+
+@app.on_event("startup")
+def load_models():
+    if MODEL_WARMUP == "lazy":
+        warmup_state["status"] = "skipped"
+    elif MODEL_WARMUP == "blocking":
+        warm_up_models()
+    else:
+        threading.Thread(target=warm_up_models, name="model-warmup", daemon=True).start()
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_workers.start()
+
+@app.on_event("startup")
+def start_mailer():
+    mailer.start()
+
+@app.on_event("startup")
+def record_startup_time():
+    # Registered last, so this is the time until the server can answer health checks
+    elapsed = time.perf_counter() - IMPORT_STARTED
+    metrics.STARTUP_SECONDS.set(elapsed, phase="startup")
+    logger.info(f"Startup complete in {elapsed:.2f}s, {IMPORT_SECONDS}s of it imports (warm-up mode: {MODEL_WARMUP})")
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_workers.stop()
+
+@app.on_event("shutdown")
+async def stop_batches():
+    for task in list(batch_tasks):
+        task.cancel()
+    await asyncio.gather(*batch_tasks, return_exceptions=True)
+
+@app.on_event("shutdown")
+def stop_mailer():
+    mailer.stop()
+
 @app.get("/")
 async def root():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness, unlike / (liveness): 503 until warm-up has loaded the models or given up on them."""
+    detector_state = get_detector().state
+    warming = warmup_state["status"] in ("pending", "running")
+    body = {
+        "status": "loading" if warming else ("ready" if detector_state == "loaded" else "degraded"),
+        "detector": detector_state,
+        "openai_client": client is not None,
+        "warmup": warmup_state,
+        "import_seconds": IMPORT_SECONDS,
+    }
+    return JSONResponse(status_code=503 if warming else 200, content=body)
+
+def resolve_client_rules(client_rules: Optional[str], client_key: Optional[str]) -> ClientRules:
+    """Rules from the registry when a client key is given, otherwise parsed from the posted rules text."""
+    if client_key:
+        try:
+            rules = rules_registry.get(client_key)
+        except Exception as e:
+            raise ReviewError(500, {"error": f"Client rules error: {str(e)}"})
+        if rules is None:
+            logger.error(f"Rules not found for client: {client_key}")
+            raise ReviewError(404, {"error": "Rules not found for this client."})
+        return rules
+    if client_rules is None:
+        raise ReviewError(400, {"error": "Either client_key or client_rules is required."})
+    return parse_rules("custom", client_rules)
+
 @app.post("/vision-review")
 async def vision_review(
     files: List[UploadFile] = File(...),
-    client_rules: str = Form(...),
+    client_rules: Optional[str] = Form(None),
+    client_key: Optional[str] = Form(None),
+    file_number: str = Form(...),
+    ia_company: str = Form(...),
+    appraiser_id: str = Form(...)
+):
+    if not appraiser_id.strip():
+        return JSONResponse(status_code=400, content={"error": "Appraiser ID is required."})
+
+    outputs = {}
+
+    def progress(stage: str, data: dict):
+        if stage == "report_pdf":
+            outputs["pdf_url"] = data["pdf_url"]
+
+    try:
+        rules = await asyncio.to_thread(resolve_client_rules, client_rules, client_key)
+        async with tenant_slot(ia_company):
+            result = await run_review(files, rules, file_number, ia_company, appraiser_id, progress=progress)
+        result["pdf_url"] = outputs["pdf_url"]
+        return result
+    except ReviewError as e:
+        return JSONResponse(status_code=e.status_code, content=e.content)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/vision-review/stream")
+async def vision_review_stream(
+    files: List[UploadFile] = File(...),
+    client_rules: Optional[str] = Form(None),
+    client_key: Optional[str] = Form(None),
     file_number: str = Form(...),
     ia_company: str = Form(...),
     appraiser_id: str = Form(...)
 ):
+    """/vision-review as server-sent events: a stage event as each local step finishes, the GPT review as
+    token events while it is generated, then a result event (or an error event with its status code)."""
     if not appraiser_id.strip():
         return JSONResponse(status_code=400, content={"error": "Appraiser ID is required."})
+    try:
+        rules = await asyncio.to_thread(resolve_client_rules, client_rules, client_key)
+    except ReviewError as e:
+        return JSONResponse(status_code=e.status_code, content=e.content)
+
+    events = asyncio.Queue()
+    outputs = {}
+
+    def progress(stage: str, data: dict):
+        if stage == "report_pdf":
+            outputs["pdf_url"] = data["pdf_url"]
+        events.put_nowait(("stage", {"stage": stage, **data}))
+
+    def on_token(text: str):
+        events.put_nowait(("token", {"text": text}))
+
+    async def review():
+        try:
+            async with tenant_slot(ia_company):
+                result = await run_review(files, rules, file_number, ia_company, appraiser_id,
+                                          progress=progress, on_token=on_token)
+            result["pdf_url"] = outputs["pdf_url"]
+            events.put_nowait(("result", result))
+        except ReviewError as e:
+            events.put_nowait(("error", {"status_code": e.status_code, **e.content}))
+        except Exception as e:
+            logger.error(f"Streamed review failed: {str(e)}")
+            events.put_nowait(("error", {"status_code": 500, "error": str(e)}))
+        finally:
+            events.put_nowait(None)
+
+    async def stream():
+        # The upload files stay open until the response is finished, so the review runs while streaming
+        task = asyncio.create_task(review())
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(events.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is None:
+                    break
+                yield sse_event(*item)
+        finally:
+            # Client went away: stop the review instead of finishing it for nobody
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+class ReviewDraft(NamedTuple):
+    """A review up to the GPT call: the request to send and everything scoring needs afterwards."""
+    client_rules: ClientRules
+    prompt: str
+    vision_message: Optional[dict]  # Dropped by the batch runner once the request is written out
+    gpt_key: str
+    combined_text: str
+    estimate_fields: EstimateFields
+    skip_labor_tax_checks: bool
+    corner_deduction: float
+    image_findings: dict
+    image_prep: dict
+
+def gpt_messages(draft: ReviewDraft) -> list:
+    return [{"role": "system", "content": draft.prompt}, draft.vision_message]
+
+def report_progress(progress, stage: str, **data):
+    if progress is not None:
+        progress(stage, data)
+
+async def run_review(files: List[UploadFile], client_rules: ClientRules, file_number: str,
+                     ia_company: str, appraiser_id: str, progress=None, on_token=None, send_email=True) -> dict:
+    """The full review pipeline. progress(stage, data), if given, is called as each stage completes;
+    on_token(text), if given, receives the GPT review in pieces as it is generated."""
+    with metrics.request_breakdown() as breakdown:
+        draft = await prepare_review(files, client_rules, file_number, progress)
+        try:
+            gpt_output = await request_gpt_review(draft, on_token)
+            result = await finish_review(draft, gpt_output, file_number, ia_company, appraiser_id, progress,
+                                         send_email)
+        except Exception as e:
+            logger.error(f"API error: {str(e)}")
+            raise ReviewError(500, {"error": str(e), "gpt_output": "\u274c AI review failed."})
+    result["timings"] = breakdown.summary()
+    return result
+
+async def prepare_review(files: List[UploadFile], client_rules: ClientRules, file_number: str,
+                         progress=None) -> ReviewDraft:
+    """Everything before the GPT call: text extraction, the photo stages and the prompt."""
+    budget = MemoryBudget()
+    uploads = []
+    try:
+        # Uploads stay in the parser's spooled files; only their hashes and sizes are read here
+        uploads = await asyncio.to_thread(adopt_uploads, files, budget)
+        draft = await _prepare_from_uploads(uploads, budget, client_rules, file_number, progress)
+    except RequestTooLarge as e:
+        logger.error(f"Request too large: {str(e)}")
+        raise ReviewError(413, {"error": str(e)})
+    finally:
+        for upload in uploads:
+            upload.close()
+    metrics.count("memory_peak_bytes", budget.peak)
+    metrics.count("raster_evictions", budget.evictions)
+    return draft
+
+async def _prepare_from_uploads(uploads: List[SpooledUpload], budget: MemoryBudget, client_rules: ClientRules,
+                                file_number: str, progress=None) -> ReviewDraft:
+    def report(stage: str, **data):
+        report_progress(progress, stage, **data)
+
+    async def reported(stage: str, work, summary):
+        # Sent as soon as this stage finishes, not when the slowest of the concurrent stages does
+        result = await work
+        report(stage, **summary(result))
+        return result
 
-    images = []
-    texts = []
     image_files = []
+    text_uploads = []
 
-    for file in files:
-        content = await file.read()
-        name = file.filename.lower()
+    for upload in uploads:
+        name = upload.filename.lower()
+        kind = os.path.splitext(name)[1].lstrip(".") or "other"
+        metrics.UPLOAD_BYTES.inc(upload.size, kind=kind)
+        metrics.count("upload_bytes", upload.size)
         if name.endswith((".jpg", ".jpeg", ".png")):
-            image_files.append(file)
-            b64 = base64.b64encode(content).decode("utf-8")
-            images.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}})
-        elif name.endswith(".pdf"):
-            text = extract_text_from_pdf(io.BytesIO(content))
-            if "\u274c" in text:
-                logger.error(f"PDF processing failed: {text}")
-                return JSONResponse(status_code=500, content={"error": f"PDF processing failed: {text}"})
-            texts.append(text)
-            logger.debug(f"Extracted text from PDF: {text[:200]}...")
-        elif name.endswith(".docx"):
-            texts.append(extract_text_from_docx(io.BytesIO(content)))
-        elif name.endswith(".txt"):
-            texts.append(content.decode("utf-8", errors="ignore"))
+            image_files.append(upload)
         else:
-            texts.append(f"\u26a0\ufe0f Skipped unsupported file: {file.filename}")
+            text_uploads.append(upload)
+    metrics.IMAGES.inc(len(image_files))
+    metrics.count("images", len(image_files))
+
+    # Decode and OCR each photo once; advisor detection, photo compliance and fraud scoring share the results.
+    # Each decoded raster is charged to the request's memory budget and dropped once these consumers are done.
+    image_analyses = ImageAnalysisSet(image_files, corner_detector=get_detector(), cache=result_cache, budget=budget,
+                                      raster_users=("ocr", "corners") + GPT_RASTER_USERS + FRAUD_RASTER_USERS)
+    # Document extraction and the photo stages are independent, so they run concurrently off the event loop
+    stage_results = await asyncio.gather(
+        reported("text_extraction", asyncio.gather(*(extract_upload_text(upload) for upload in text_uploads)),
+                 lambda texts: {"documents": len(texts)}),
+        run_stage("advisor_detection", advisor_report_in_photos, image_analyses),
+        reported("photo_compliance", run_stage("photo_compliance", check_required_photos, image_analyses),
+                 lambda result: {"photos": len(image_analyses), "missing_photos": result[0],
+                                 "corner_deduction": result[1]}),
+        # Also flags photos already submitted with another file number, then indexes this file's photos
+        reported("image_forensics",
+                 run_stage("fraud", check_image_forensics, image_analyses, file_number, photo_index),
+                 lambda findings: {"flags": len(findings["flags"]), "notes": len(findings["notes"])}),
+        # Downscaled, deduplicated copies for GPT; OCR and YOLO keep working on the originals
+        run_stage("image_prep", prepare_images_for_gpt, image_analyses, result_cache),
+    )
+    texts, advisor_in_photos, (missing_photos, corner_deduction), image_findings, (images, image_prep) = stage_results
+    image_analyses.close()
+    budget.raise_if_exceeded()
+    texts = list(texts)
+    for upload, text in zip(text_uploads, texts):
+        if upload.filename.lower().endswith(".pdf") and "\u274c" in text:
+            logger.error(f"PDF processing failed: {text}")
+            raise ReviewError(500, {"error": f"PDF processing failed: {text}"})
 
     combined_text = '\n'.join(texts).lower()
-    advisor_confirmed = advisor_report_present(texts, image_files)
+    # Labor, tax, claim number, advisor and no-damage checks all read this one extraction
+    estimate_fields = await run_stage("field_extraction", extract_estimate_fields, combined_text)
+    advisor_confirmed = estimate_fields.advisor_report or advisor_in_photos
     advisor_hint = "\n\nCONFIRMED: CCC Advisor Report is included." if advisor_confirmed else ""
-    missing_photos, corner_deduction = check_required_photos(image_files)
     photo_hint = f"\n\nMISSING PHOTOS: {', '.join(missing_photos) if missing_photos else 'None'}"
 
     # Check for no damage phrases
-    skip_labor_tax_checks = any(phrase in combined_text for phrase in ["no damage found", "no damage identified"])
+    skip_labor_tax_checks = estimate_fields.no_damage
 
     vision_message = {"role": "user", "content": []}
     if texts:
@@ -258,11 +600,12 @@ async def vision_review(
         logger.debug(f"Vision message text: {vision_message['content'][0]['text'][:200]}...")
     if images:
         vision_message["content"].extend(images)
-        logger.debug(f"Vision message includes {len(images)} images")
+        logger.debug(f"Vision message includes {len(images)} images "
+                     f"({image_prep['bytes_saved']} bytes, ~{image_prep['tokens_saved_est']} tokens saved)")
 
     if not vision_message["content"]:
         logger.error("No content available for GPT processing")
-        return JSONResponse(status_code=400, content={"error": "No valid data extracted for processing"})
+        raise ReviewError(400, {"error": "No valid data extracted for processing"})
 
     prompt = f"""
     You are an AI auto damage auditor. Always output:
@@ -282,143 +625,452 @@ async def vision_review(
     - Use total loss status to switch evaluation mode
     - Do not include disclaimers about processing personal data (e.g., names); focus solely on vehicle assessment data.
 
-    {client_rules}
+    {client_rules.text}
     """
 
+    logger.debug(f"Image analysis stats: {image_analyses.stats.summary()}")
+    # Identical prompt + documents + photos return the stored review without calling the API
+    gpt_key = content_hash(GPT_MODEL, GPT_MAX_TOKENS, prompt, json.dumps(vision_message, sort_keys=True))
+    return ReviewDraft(client_rules, prompt, vision_message, gpt_key, combined_text, estimate_fields,
+                       skip_labor_tax_checks, corner_deduction, image_findings, image_prep)
+
+def record_gpt_usage(prompt_tokens: int, completion_tokens: int):
+    metrics.OPENAI_TOKENS.inc(prompt_tokens, type="prompt")
+    metrics.OPENAI_TOKENS.inc(completion_tokens, type="completion")
+    metrics.count("openai_prompt_tokens", prompt_tokens)
+    metrics.count("openai_completion_tokens", completion_tokens)
+
+def store_gpt_review(draft: ReviewDraft, content: Optional[str]) -> str:
+    if content:
+        result_cache.set("gpt_review", draft.gpt_key, content)
+        return content
+    return "\u274c GPT returned no output."
+
+async def request_gpt_review(draft: ReviewDraft, on_token=None) -> str:
+    gpt_output = await asyncio.to_thread(result_cache.get, "gpt_review", draft.gpt_key)
+    if gpt_output is None:
+        with metrics.stage_timer("openai"):
+            if on_token is None:
+                response = await get_openai_client().chat.completions.create(
+                    model=GPT_MODEL,
+                    messages=gpt_messages(draft),
+                    max_tokens=GPT_MAX_TOKENS
+                )
+                content, usage = response.choices[0].message.content, response.usage
+            else:
+                content, usage = await stream_gpt_review(gpt_messages(draft), on_token)
+        if usage is not None:
+            record_gpt_usage(usage.prompt_tokens, usage.completion_tokens)
+        gpt_output = await asyncio.to_thread(store_gpt_review, draft, content)
+    elif on_token is not None:
+        on_token(gpt_output)
+    logger.debug(f"GPT output: {gpt_output[:200]}...")
+    return gpt_output
+
+async def finish_review(draft: ReviewDraft, gpt_output: str, file_number: str, ia_company: str,
+                        appraiser_id: str, progress=None, send_email=True) -> dict:
+    """Scoring, fraud risk, the report PDF and (unless a batch sends one summary) the email."""
+    report_progress(progress, "gpt_review")
+    estimate_fields = draft.estimate_fields
+    review_fields = parse_review_output(gpt_output)
+    claim_number_from_gpt = review_fields.claim_number
+    vehicle = review_fields.vehicle
+    score = review_fields.compliance_score
+    total_loss_status = review_fields.total_loss
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": prompt}, vision_message],
-            max_tokens=3500
-        )
-        gpt_output = response.choices[0].message.content or "\u274c GPT returned no output."
-        logger.debug(f"GPT output: {gpt_output[:200]}...")
-        claim_number_from_gpt = extract_field("Claim", gpt_output)
-        vehicle = extract_field("Vehicle", gpt_output)
-        mileage_match = re.search(r"mileage:\s*(\d{1,6}(?:,\d{3})*(?:\s*miles|\s*km)?)", vehicle.lower())
-        if mileage_match:
-            vehicle = re.sub(r"mileage:\s*\d{1,6}(?:,\d{3})*(?:\s*miles|\s*km)?", "", vehicle).strip()
-        score = extract_field("Compliance Score", gpt_output)
-        total_loss_status = extract_field("Total Loss Status", gpt_output).lower() == "yes"
+        score = int(score.strip("%"))
+    except ValueError:
+        score = 100
 
-        try:
-            score = int(score.strip("%"))
-        except ValueError:
-            score = 100
-
-        score_adj = 0
-        if not total_loss_status:
-            score_adj = check_labor_and_tax_score(combined_text, client_rules, skip_labor_tax_checks)
-            score_adj -= corner_deduction  # Apply YOLO-based corner deduction
+    score_adj = 0
+    if not total_loss_status:
+        score_adj = check_labor_and_tax_score(estimate_fields, draft.client_rules, draft.skip_labor_tax_checks)
+        score_adj -= draft.corner_deduction  # Apply YOLO-based corner deduction
+    else:
+        score_adj -= 25 * (len(TOTAL_LOSS_FIELDS) - len(estimate_fields.total_loss_fields))
+
+    final_score = max(0, min(100, score + score_adj))
+
+    # Calculate fraud risk without reference claim
+    fraud_result = await run_stage("fraud", calculate_fraud_risk, draft.combined_text,
+                                   image_findings=draft.image_findings, estimate_fields=estimate_fields)
+    report_progress(progress, "scoring", score=final_score, fraud_score=fraud_result["score"])
+
+    report = await run_stage("report_pdf", render_report_pdf, file_number, ia_company, appraiser_id,
+                             fraud_result, total_loss_status, gpt_output)
+    report_progress(progress, "report_pdf", pdf_path=report.path, version=report.version, pdf_url=report_url(report))
+    if send_email:
+        await run_stage("email", send_report_email, file_number, ia_company, appraiser_id,
+                        claim_number_from_gpt, final_score, fraud_result, gpt_output)
+        report_progress(progress, "email_queued")
+
+    return {
+        "gpt_output": gpt_output,
+        "file_number": file_number,
+        "claim_number": claim_number_from_gpt or "N/A",
+        "vehicle": vehicle,
+        "score": f"{final_score}%",
+        "fraud_score": f"{fraud_result['score']}%",
+        "image_prep": draft.image_prep
+    }
+
+async def stream_gpt_review(messages: list, on_token) -> tuple:
+    """The GPT review via the streaming API, passing each text delta to on_token. Returns (text, usage)."""
+    stream = await get_openai_client().chat.completions.create(
+        model=GPT_MODEL,
+        messages=messages,
+        max_tokens=GPT_MAX_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    parts = []
+    usage = None
+    async for chunk in stream:
+        # With include_usage the last chunk has no choices, only the token counts
+        if chunk.usage is not None:
+            usage = chunk.usage
+        for choice in chunk.choices:
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                on_token(choice.delta.content)
+    return "".join(parts), usage
+
+async def run_review_job(job: dict):
+    params = job["params"]
+    uploads = [UploadFile(file=open(f["path"], "rb"), filename=f["filename"]) for f in job["files"]]
+    outputs = {}
+    progress_writes = asyncio.Queue()
+
+    def progress(stage: str, data: dict):
+        if stage == "report_pdf":
+            outputs["pdf_path"] = data["pdf_path"]
+        progress_writes.put_nowait((stage, data))
+
+    async def write_progress():
+        # One writer keeps the stages in order while SQLite runs off the event loop
+        while True:
+            stage, data = await progress_writes.get()
+            try:
+                await asyncio.to_thread(job_store.record_progress, job["id"], stage, data)
+            finally:
+                progress_writes.task_done()
+
+    writer = asyncio.create_task(write_progress())
+    try:
+        rules = await asyncio.to_thread(resolve_client_rules, params.get("client_rules"), params.get("client_key"))
+        async with tenant_slot(params["ia_company"]):
+            result = await run_review(uploads, rules, params["file_number"],
+                                      params["ia_company"], params["appraiser_id"], progress=progress)
+        await progress_writes.join()
+        await asyncio.to_thread(job_store.complete, job["id"], result, outputs.get("pdf_path"))
+    except ReviewError as e:
+        await progress_writes.join()
+        await asyncio.to_thread(job_store.fail, job["id"], {"status_code": e.status_code, **e.content})
+    finally:
+        writer.cancel()
+        for upload in uploads:
+            upload.file.close()
+
+result_cache = get_cache()
+photo_index = get_photo_index()
+report_store = get_report_store()
+rules_registry = get_registry()
+mailer = get_mailer()
+job_store = JobStore()
+job_workers = JobWorkers(job_store, run_review_job)
+# Batches in progress; finished ones are read back from their results file
+batch_runs: Dict[str, BatchRun] = {}
+batch_tasks = set()
+
+@app.post("/vision-review/jobs")
+async def submit_review_job(
+    files: List[UploadFile] = File(...),
+    client_rules: Optional[str] = Form(None),
+    client_key: Optional[str] = Form(None),
+    file_number: str = Form(...),
+    ia_company: str = Form(...),
+    appraiser_id: str = Form(...)
+):
+    if not appraiser_id.strip():
+        return JSONResponse(status_code=400, content={"error": "Appraiser ID is required."})
+    try:
+        # Reject unknown clients now rather than when a worker picks the job up
+        await asyncio.to_thread(resolve_client_rules, client_rules, client_key)
+    except ReviewError as e:
+        return JSONResponse(status_code=e.status_code, content=e.content)
+    params = {"client_rules": client_rules, "client_key": client_key, "file_number": file_number,
+              "ia_company": ia_company, "appraiser_id": appraiser_id}
+    try:
+        uploads = await asyncio.to_thread(adopt_uploads, files, MemoryBudget())
+    except RequestTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    # Copied from the parser's spooled files to the job directory in chunks
+    job_id = await asyncio.to_thread(job_store.enqueue, params, [(u.filename, u.file) for u in uploads])
+    job_workers.notify()
+    logger.debug(f"Queued review job {job_id} for file {file_number}")
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+@app.post("/vision-review/batch")
+async def vision_review_batch(
+    archive: Optional[UploadFile] = File(None),
+    manifest: Optional[str] = Form(None),
+    files: Optional[List[UploadFile]] = File(None),
+    client_rules: Optional[str] = Form(None),
+    client_key: Optional[str] = Form(None),
+    ia_company: Optional[str] = Form(None),
+    appraiser_id: Optional[str] = Form(None),
+    openai_batch: bool = Form(False)
+):
+    """Many claims in one call: a zip with one folder per claim, or a JSON manifest naming the uploads of
+    each claim. Streams one JSON line per claim as it finishes and a summary line at the end; a single
+    summary email replaces the per-claim ones. The batch keeps running if the client disconnects, and
+    /batches/{batch_id}/results replays it."""
+    if (archive is None) == (manifest is None):
+        return JSONResponse(status_code=400, content={"error": "Send either an archive or a manifest."})
+    try:
+        rules = await asyncio.to_thread(resolve_client_rules, client_rules, client_key)
+    except ReviewError as e:
+        return JSONResponse(status_code=e.status_code, content=e.content)
+    defaults = {"ia_company": ia_company, "appraiser_id": appraiser_id}
+    run = await asyncio.to_thread(BatchRun, 0)
+    try:
+        # Claim files are copied out of the upload into the batch directory once, before the response starts
+        if archive is not None:
+            claims = await asyncio.to_thread(claims_from_archive, archive.file, run.inputs_dir, defaults)
         else:
-            required_fields = ["insured", "policy #", "claim #", "date of loss"]
-            found_fields = [f for f in required_fields if f in combined_text]
-            score_adj -= 25 * (len(required_fields) - len(found_fields))
-
-        final_score = max(0, min(100, score + score_adj))
-
-        # Calculate fraud risk without reference claim
-        fraud_result = calculate_fraud_risk(combined_text, image_files)
-        fraud_explanation = fraud_result.get("explanation", "No fraud indicators detected.")
-
-        base_pdf_path = f"{file_number}.pdf"
-        pdf_path = base_pdf_path
-        counter = 1
-        while os.path.exists(pdf_path):
-            pdf_path = f"{file_number}_{counter}.pdf"
-            counter += 1
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.add_font("DejaVu", "", "DejaVuSans.ttf", uni=True)
-        pdf.set_font("DejaVu", size=11)
-        pdf.cell(200, 10, txt="NSPXN.com AI Review Report", ln=True, align='C')
-        pdf.ln(5)
-        pdf.multi_cell(0, 10, f"File Number: {file_number}")
-        pdf.multi_cell(0, 10, f"IA Company: {ia_company}")
-        pdf.multi_cell(0, 10, f"Appraiser ID #: {appraiser_id}")
-        pdf.ln(5)
-        pdf.set_text_color(200, 0, 0)
-        pdf.multi_cell(0, 10, f"Fraud Risk Score: {fraud_result['score']}%")
-        if fraud_result["flags"]:
-            pdf.set_text_color(0, 0, 0)
-            pdf.multi_cell(0, 10, "Fraud Indicators:")
-            for flag in fraud_result["flags"]:
-                pdf.multi_cell(0, 10, f"- {flag}")
-            pdf.ln(5)
-            pdf.multi_cell(0, 10, "Fraud Risk Explanation:")
-            pdf.multi_cell(0, 10, fraud_explanation)
-        pdf.set_text_color(0, 0, 0)
-        pdf.ln(5)
-        pdf.multi_cell(0, 10, f"Total Loss Status: {'Yes' if total_loss_status else 'No'}")
-        pdf.ln(5)
-        pdf.multi_cell(0, 10, "AI-4-IA Review Summary:")
-        pdf.set_font("DejaVu", size=9)
-        pdf.multi_cell(0, 10, gpt_output)
-        pdf.output(pdf_path)
-
-        msg = EmailMessage()
-        msg["Subject"] = f"AI-4-IA Review: {claim_number_from_gpt or 'N/A'}"
-        msg["From"] = "noreply@nspxn.com"
-        msg["To"] = "info@nspxn.com"
-        email_body = f"""NSPXN.com AI4IA Review Report
+            uploads = [(f.filename, f.file) for f in files or []]
+            claims = await asyncio.to_thread(claims_from_manifest, manifest, uploads, run.inputs_dir, defaults)
+    except BatchError as e:
+        await asyncio.to_thread(shutil.rmtree, run.directory, ignore_errors=True)
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    run.total = len(claims)
+    batch_runs[run.id] = run
+    task = asyncio.create_task(run_batch_review(run, claims, rules, openai_batch))
+    batch_tasks.add(task)
+    task.add_done_callback(batch_tasks.discard)
+    logger.debug(f"Started batch {run.id} with {run.total} claims")
+    return StreamingResponse(run.follow(), media_type="application/x-ndjson", headers={"X-Batch-Id": run.id})
 
-File Number: {file_number}
-IA Company: {ia_company}
-Appraiser ID #: {appraiser_id}
-Adjusted Compliance Score: {final_score}%
-Fraud Risk Score: {fraud_result['score']}%
+async def run_batch_review(run: BatchRun, claims: List[BatchClaim], rules: ClientRules, use_openai_batch: bool):
+    """Reviews every claim of a batch on a pool of BATCH_WORKERS and sends one summary email.
 
-AI Review Summary:
-{gpt_output}
-"""
-        msg.set_content(email_body.encode("utf-8", errors="ignore").decode("utf-8"))
-        with smtplib.SMTP_SSL("mail.tierra.net", 465) as smtp:
-            smtp.login("info@nspxn.com", "grr2025GRR")
-            smtp.send_message(msg)
-
-        return {
-            "gpt_output": gpt_output,
-            "file_number": file_number,
-            "claim_number": claim_number_from_gpt or "N/A",
-            "vehicle": vehicle,
-            "score": f"{final_score}%",
-            "fraud_score": f"{fraud_result['score']}%"
-        }
+    With use_openai_batch, each claim's GPT request is written out as soon as its local stages finish
+    and all of them go through the OpenAI Batch API together (at half the token price); requests the
+    batch does not answer, or batches too small to be worth the wait, use the regular API.
+    """
+    workers = asyncio.Semaphore(BATCH_WORKERS)
+    writer = BatchRequestWriter(run.directory) if use_openai_batch else None
+    deferred = {}  # custom_id -> (claim, draft without its vision message, timings before the GPT call)
+    rows = []
 
-    except Exception as e:
-        logger.error(f"API error: {str(e)}")
-        return JSONResponse(status_code=500, content={"error": str(e), "gpt_output": "\u274c AI review failed."})
+    async def record(claim: BatchClaim, result: Optional[dict] = None, error: Optional[dict] = None):
+        row = {"file_number": claim.file_number, "ia_company": claim.ia_company, "appraiser_id": claim.appraiser_id}
+        if error is None:
+            rows.append({**row, "status": "done", **result})
+        else:
+            rows.append({**row, "status": "failed", **error})
+        await run.record(claim.file_number, result=result, error=error)
+        await asyncio.to_thread(shutil.rmtree, claim.directory, ignore_errors=True)
 
-@app.get("/download-pdf")
-async def download_pdf(file_number: str):
-    pdf_path = f"{file_number}.pdf"
-    if os.path.exists(pdf_path):
-        return FileResponse(path=pdf_path, media_type="application/pdf", filename=pdf_path)
-    return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    async def record_failure(claim: BatchClaim, e: Exception):
+        if isinstance(e, ReviewError):
+            await record(claim, error={"status_code": e.status_code, **e.content})
+            return
+        # One broken claim must not stop the rest of the batch
+        logger.error(f"Batch claim {claim.file_number} failed: {str(e)}")
+        await record(claim, error={"status_code": 500, "error": str(e)})
+
+    async def finish(claim: BatchClaim, draft: ReviewDraft, gpt_output: Optional[str] = None) -> dict:
+        outputs = {}
+
+        def progress(stage: str, data: dict):
+            if stage == "report_pdf":
+                outputs["pdf_url"] = data["pdf_url"]
 
-@app.get("/client-rules/{client_name}")
-async def get_client_rules(client_name: str):
-    rules_dir = "client_rules"
-    file_name = f"{client_name}.docx"
-    file_path = os.path.join(rules_dir, file_name)
-    if os.path.exists(file_path):
         try:
-            doc = Document(file_path)
-            text = '\n'.join([p.text for p in doc.paragraphs if p.text.strip()])
-            logger.debug(f"Client rules for {client_name}: {text[:500]}...")
-            return {"text": text}
+            if gpt_output is None:
+                gpt_output = await request_gpt_review(draft)
+            result = await finish_review(draft, gpt_output, claim.file_number, claim.ia_company, claim.appraiser_id,
+                                         progress, send_email=False)
         except Exception as e:
-            logger.error(f"Client rules error: {str(e)}")
-            return JSONResponse(status_code=500, content={"error": str(e)})
-    else:
-        logger.error(f"Rules not found for client: {client_name}")
-        return JSONResponse(status_code=404, content={"error": "Rules not found for this client."})
+            logger.error(f"API error: {str(e)}")
+            raise ReviewError(500, {"error": str(e), "gpt_output": "\u274c AI review failed."})
+        result["pdf_url"] = outputs["pdf_url"]
+        return result
+
+    async def prepare(n: int, claim: BatchClaim):
+        async with workers:
+            uploads = [UploadFile(file=open(path, "rb"), filename=name) for name, path in claim.files]
+            try:
+                async with tenant_slot(claim.ia_company):
+                    with metrics.request_breakdown() as breakdown:
+                        draft = await prepare_review(uploads, rules, claim.file_number)
+                        cached = None
+                        if writer is not None:
+                            cached = await asyncio.to_thread(result_cache.get, "gpt_review", draft.gpt_key)
+                        if writer is None or cached is not None:
+                            result = await finish(claim, draft, cached)
+                    if writer is not None and cached is None:
+                        # Serializing a message full of base64 photos is too slow for the event loop
+                        body = {"model": GPT_MODEL, "messages": gpt_messages(draft), "max_tokens": GPT_MAX_TOKENS}
+                        await asyncio.to_thread(writer.add, str(n), body)
+                        deferred[str(n)] = (claim, draft._replace(vision_message=None), breakdown.summary())
+                        return
+                result["timings"] = breakdown.summary()
+                await record(claim, result=result)
+            except Exception as e:
+                await record_failure(claim, e)
+            finally:
+                for upload in uploads:
+                    upload.file.close()
+
+    async def complete(custom_id: str, completions: dict, fallback: dict):
+        claim, draft, prepare_timings = deferred[custom_id]
+        async with workers:
+            try:
+                async with tenant_slot(claim.ia_company):
+                    with metrics.request_breakdown() as breakdown:
+                        completion = completions.get(custom_id)
+                        if completion is not None:
+                            record_gpt_usage(completion.prompt_tokens, completion.completion_tokens)
+                            gpt_output = await asyncio.to_thread(store_gpt_review, draft, completion.content)
+                            result = await finish(claim, draft, gpt_output)
+                        else:
+                            draft = draft._replace(vision_message=fallback[custom_id]["messages"][1])
+                            result = await finish(claim, draft)
+                result["timings"] = {"prepare": prepare_timings, "finish": breakdown.summary()}
+                await record(claim, result=result)
+            except Exception as e:
+                await record_failure(claim, e)
+
+    await asyncio.gather(*(prepare(n, claim) for n, claim in enumerate(claims)))
+    used_openai_batch = False
+    if deferred:
+        completions = {}
+        if len(deferred) >= OPENAI_BATCH_MIN_REQUESTS:
+            run.status = WAITING_OPENAI
+            used_openai_batch = True
+            try:
+                completions = await run_batch(get_openai_client(), writer)
+            except Exception as e:
+                logger.error(f"OpenAI batch submission failed: {str(e)}")
+            run.status = BATCH_RUNNING
+        unanswered = [custom_id for custom_id in deferred if custom_id not in completions]
+        fallback = await asyncio.to_thread(writer.bodies, unanswered) if unanswered else {}
+        await asyncio.gather(*(complete(custom_id, completions, fallback) for custom_id in deferred))
+    try:
+        await run_stage("email", send_batch_summary_email, run, rows)
+        emailed = True
+    except Exception as e:
+        logger.error(f"Batch summary email error: {str(e)}")
+        emailed = False
+    await run.finish(summary_email=emailed, openai_batch=used_openai_batch)
+    batch_runs.pop(run.id, None)
+    logger.debug(f"Finished batch {run.id}: {run.succeeded} succeeded, {run.failed} failed")
 
+@app.get("/batches/{batch_id}")
+async def get_batch_status(batch_id: str):
+    run = batch_runs.get(batch_id)
+    if run is not None:
+        return run.summary()
+    path = batch_results_path(batch_id)
+    if path is None:
+        return JSONResponse(status_code=404, content={"error": "Batch not found."})
+    last = await asyncio.to_thread(last_record, path)
+    return last.get("summary", {"batch_id": batch_id, "status": "interrupted"})
 
+@app.get("/batches/{batch_id}/results")
+async def get_batch_results(batch_id: str):
+    run = batch_runs.get(batch_id)
+    if run is not None:
+        return StreamingResponse(run.follow(), media_type="application/x-ndjson", headers={"X-Batch-Id": run.id})
+    path = batch_results_path(batch_id)
+    if path is None:
+        return JSONResponse(status_code=404, content={"error": "Batch not found."})
+    return FileResponse(path=path, media_type="application/x-ndjson", filename=f"batch_{batch_id}.jsonl")
 
+def batch_results_path(batch_id: str) -> Optional[str]:
+    if not re.fullmatch(r"[0-9a-f]{32}", batch_id):
+        return None
+    path = os.path.join(BATCH_DIR, batch_id, "results.jsonl")
+    return path if os.path.exists(path) and os.path.getsize(path) else None
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
 
+@app.get("/photo-index/stats")
+async def photo_index_stats():
+    return await asyncio.to_thread(photo_index.stats)
 
+@app.get("/mail/stats")
+async def mail_stats():
+    return await asyncio.to_thread(mailer.stats)
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found."})
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "stage": job["stage"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
 
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found."})
+    if job["status"] == FAILED:
+        error = dict(job["error"])
+        return JSONResponse(status_code=error.pop("status_code", 500), content=error)
+    if job["status"] != DONE:
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": job["status"], "stage": job["stage"]})
+    return job["result"]
+
+@app.get("/jobs/{job_id}/pdf")
+async def get_job_pdf(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None or job["status"] != DONE or not job["pdf_path"] or not os.path.exists(job["pdf_path"]):
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    return FileResponse(path=job["pdf_path"], media_type="application/pdf",
+                        filename=f"{job['params']['file_number']}.pdf")
+
+@app.get("/download-pdf")
+async def download_pdf(request: Request, file_number: str, version: Optional[int] = None):
+    report = await asyncio.to_thread(report_store.get, file_number, version)
+    if report is None:
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    # Reports are content-addressed, so the hash is a strong ETag; a numbered version never changes
+    etag = f'"{report.sha256}"'
+    headers = {"ETag": etag,
+               "Cache-Control": "private, no-cache" if version is None else "private, max-age=31536000, immutable"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    # FileResponse answers Range and If-Range requests against the same ETag
+    return FileResponse(path=report.path, media_type="application/pdf", filename=report.filename, headers=headers)
+
+@app.get("/client-rules/{client_name}")
+async def get_client_rules(client_name: str):
+    try:
+        rules = await asyncio.to_thread(rules_registry.get, client_name)
+    except Exception as e:
+        logger.error(f"Client rules error: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    if rules is None:
+        logger.error(f"Rules not found for client: {client_name}")
+        return JSONResponse(status_code=404, content={"error": "Rules not found for this client."})
+    logger.debug(f"Client rules for {client_name}: {rules.text[:500]}...")
+    return {"text": rules.text}
@@ -0,0 +1,169 @@
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+import contextvars
+import functools
+import threading
+import bisect
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry = []
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                le = 'le="+Inf"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {series[-1]}"
+                yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}"
+                yield f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}"
+
+STAGE_SECONDS = Histogram("nspxn_stage_duration_seconds", "Time spent in each review pipeline stage.", ("stage",))
+REVIEW_SECONDS = Histogram("nspxn_review_duration_seconds", "End-to-end review pipeline time.")
+PDF_PAGES = Counter("nspxn_pdf_pages_total", "Estimate PDF pages processed, by extraction method.", ("method",))
+IMAGES = Counter("nspxn_images_total", "Photos analysed.")
+UPLOAD_BYTES = Counter("nspxn_upload_bytes_total", "Uploaded bytes processed, by file kind.", ("kind",))
+OPENAI_TOKENS = Counter("nspxn_openai_tokens_total", "OpenAI token usage.", ("type",))
+CACHE_REQUESTS = Counter("nspxn_cache_requests_total", "Result cache lookups.", ("namespace", "result"))
+EMAILS = Counter("nspxn_emails_total", "Report emails by delivery outcome.", ("outcome",))
+STARTUP_SECONDS = Gauge("nspxn_startup_seconds", "Process startup time by phase (import, startup, warmup).", ("phase",))
+
+class Breakdown:
+    """Per-request stage timings and counts, returned with the review response."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_count(self, name: str, amount: float):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+                "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+                "counts": dict(self.counts),
+            }
+
+_breakdown: contextvars.ContextVar[Optional[Breakdown]] = contextvars.ContextVar("breakdown", default=None)
+
+@contextmanager
+def request_breakdown():
+    breakdown = Breakdown()
+    token = _breakdown.set(breakdown)
+    try:
+        yield breakdown
+    finally:
+        _breakdown.reset(token)
+        REVIEW_SECONDS.observe(time.perf_counter() - breakdown.started)
+
+@contextmanager
+def stage_timer(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        breakdown = _breakdown.get()
+        if breakdown is not None:
+            breakdown.add_stage(stage, elapsed)
+
+def timed(stage: str):
+    """Decorator recording a function's duration under the given stage name."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name: str, amount: float = 1):
+    """Add to a count in the current request's breakdown, if there is one."""
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown.add_count(name, amount)
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
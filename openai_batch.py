@@ -0,0 +1,100 @@
+from typing import Dict, List, NamedTuple, Optional
+import threading
+import asyncio
+import logging
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+# The Batch API costs half as much per token but may take up to the completion window; only worth it
+# for a batch with at least this many reviews that are not already in the result cache
+OPENAI_BATCH_MIN_REQUESTS = int(os.environ.get("OPENAI_BATCH_MIN_REQUESTS", "20"))
+OPENAI_BATCH_POLL_SECONDS = float(os.environ.get("OPENAI_BATCH_POLL_SECONDS", "30"))
+OPENAI_BATCH_WINDOW = os.environ.get("OPENAI_BATCH_WINDOW", "24h")
+# Input files are split below the API's 200 MB upload limit (photos make each request large)
+OPENAI_BATCH_MAX_FILE_BYTES = int(os.environ.get("OPENAI_BATCH_MAX_FILE_MB", "180")) * 1024 * 1024
+
+ENDPOINT = "/v1/chat/completions"
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+class BatchCompletion(NamedTuple):
+    content: Optional[str]
+    prompt_tokens: int
+    completion_tokens: int
+
+class BatchRequestWriter:
+    """Chat completion requests written to JSONL input files as they are prepared, so a batch of
+    hundreds of claims does not keep every photo-laden message in memory until submission."""
+
+    def __init__(self, directory: str, max_file_bytes: int = OPENAI_BATCH_MAX_FILE_BYTES):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.paths: List[str] = []
+        self.count = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def add(self, custom_id: str, body: dict):
+        """Safe to call from several threads; each request is serialized before taking the file lock."""
+        line = (json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}) + "\n").encode()
+        with self._lock:
+            if not self.paths or (self._size and self._size + len(line) > self.max_file_bytes):
+                self.paths.append(os.path.join(self.directory, f"openai_batch_{len(self.paths):03d}.jsonl"))
+                self._size = 0
+            with open(self.paths[-1], "ab") as f:
+                f.write(line)
+            self._size += len(line)
+            self.count += 1
+
+    def bodies(self, custom_ids) -> Dict[str, dict]:
+        """Request bodies read back from the input files, for requests the batch did not answer."""
+        wanted = set(custom_ids)
+        found = {}
+        for path in self.paths:
+            with open(path, "rb") as f:
+                for line in f:
+                    item = json.loads(line)
+                    if item["custom_id"] in wanted:
+                        found[item["custom_id"]] = item["body"]
+        return found
+
+async def _run_file(client, path: str) -> Dict[str, BatchCompletion]:
+    with open(path, "rb") as f:
+        uploaded = await client.files.create(file=f, purpose="batch")
+    batch = await client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT,
+                                        completion_window=OPENAI_BATCH_WINDOW)
+    logger.info(f"Submitted OpenAI batch {batch.id} from {os.path.basename(path)}")
+    while batch.status not in FINAL_STATUSES:
+        await asyncio.sleep(OPENAI_BATCH_POLL_SECONDS)
+        batch = await client.batches.retrieve(batch.id)
+    logger.info(f"OpenAI batch {batch.id} {batch.status}")
+    if not batch.output_file_id:
+        return {}
+    output = await client.files.content(batch.output_file_id)
+    results = {}
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        if response.get("status_code") != 200:
+            logger.error(f"OpenAI batch request {item.get('custom_id')} failed: {item.get('error') or response}")
+            continue
+        body = response["body"]
+        usage = body.get("usage") or {}
+        results[item["custom_id"]] = BatchCompletion(body["choices"][0]["message"].get("content"),
+                                                     usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+    return results
+
+async def run_batch(client, writer: BatchRequestWriter) -> Dict[str, BatchCompletion]:
+    """Submit every input file as its own OpenAI batch, wait for all of them and return the completions
+    by custom_id. Requests that failed, expired or errored are simply absent from the result."""
+    results = {}
+    outcomes = await asyncio.gather(*(_run_file(client, path) for path in writer.paths), return_exceptions=True)
+    for path, outcome in zip(writer.paths, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error(f"OpenAI batch for {os.path.basename(path)} failed: {str(outcome)}")
+            continue
+        results.update(outcome)
+    return results
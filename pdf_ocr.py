@@ -0,0 +1,165 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pdf2image import convert_from_path, pdfinfo_from_path
+from image_analysis import preprocess_image
+from PIL import Image
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import multiprocessing
+import pytesseract
+import subprocess
+import threading
+import tempfile
+import logging
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+def available_cores() -> int:
+    # Respect the container's CPU quota (cgroup v2) and affinity mask, not the host's core count
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cores)
+
+OCR_DPI = 150  # Stable DPI
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", str(available_cores())))
+PAGES_PER_TASK = int(os.environ.get("OCR_PAGES_PER_TASK", "2"))
+MAX_IN_FLIGHT = int(os.environ.get("OCR_MAX_IN_FLIGHT", str(OCR_WORKERS * 2)))
+# A page's text layer is used instead of OCR only when it carries body text: this many letters and digits
+# per square inch (about 190 on a letter page). A scanned page with a digital fax banner or page stamp
+# has a text layer of well under 100 and still goes to OCR.
+MIN_TEXT_LAYER_DENSITY = float(os.environ.get("PDF_MIN_TEXT_LAYER_DENSITY", "2"))
+LETTER_AREA = 8.5 * 11  # Square inches, for pages whose size pdfinfo does not report
+
+_JUNK_PAGE = re.compile(r"[\:/\d\s]{50,}")
+_WORD_CHAR = re.compile(r"[A-Za-z0-9]")
+_PAGE_SIZE = re.compile(r"([\d.]+) x ([\d.]+) pts")
+
+class PdfPage(NamedTuple):
+    number: int
+    text: Optional[str]
+    method: str  # "text" for the embedded text layer, "ocr" for tesseract
+
+def ocr_page_image(img, page_number: int) -> Optional[str]:
+    """OCR one rasterized page, returning None for empty or junk pages."""
+    processed = preprocess_image(img)
+    try:
+        ocr_text = pytesseract.image_to_string(processed, lang="eng", config='--psm 3', timeout=30)
+    except Exception as e:
+        logger.warning(f"PSM 3 failed on page {page_number}: {str(e)}")
+        ocr_text = pytesseract.image_to_string(processed, lang="eng", config='--psm 6', timeout=30)
+    if ocr_text.strip() and not _JUNK_PAGE.search(ocr_text):
+        return ocr_text.strip()
+    return None
+
+def _ocr_page_range(pdf_path: str, first_page: int, last_page: int) -> List[Tuple[int, Optional[str]]]:
+    # Runs in a pool worker. Pages are rasterized to disk and loaded one at a time, so only the page
+    # being OCR'd is in memory and its raster is freed as soon as its text is read
+    results = []
+    with tempfile.TemporaryDirectory(prefix="ocr-") as output_folder:
+        paths = convert_from_path(pdf_path, dpi=OCR_DPI, first_page=first_page, last_page=last_page,
+                                  output_folder=output_folder, paths_only=True)
+        for offset, path in enumerate(sorted(paths)):
+            page_number = first_page + offset
+            with Image.open(path) as img:
+                results.append((page_number, ocr_page_image(img, page_number)))
+            os.remove(path)
+    return results
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver avoids forking a parent that already holds torch/OpenMP threads
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=context)
+            logger.info(f"OCR process pool started with {OCR_WORKERS} workers")
+        return _pool
+
+def _page_ranges(page_numbers: List[int]) -> List[Tuple[int, int]]:
+    # Group contiguous pages into ranges of at most PAGES_PER_TASK pages
+    ranges = []
+    for page_number in sorted(page_numbers):
+        if ranges and ranges[-1][1] == page_number - 1 and page_number - ranges[-1][0] < PAGES_PER_TASK:
+            ranges[-1] = (ranges[-1][0], page_number)
+        else:
+            ranges.append((page_number, page_number))
+    return ranges
+
+def ocr_pdf_pages(pdf_path: str, page_numbers: Optional[List[int]] = None) -> List[Tuple[int, Optional[str]]]:
+    """OCR pages of a PDF (all of them by default) on the process pool and return (page number, text) in page order."""
+    if page_numbers is None:
+        page_numbers = list(range(1, int(pdfinfo_from_path(pdf_path)["Pages"]) + 1))
+    pool = get_pool()
+    results = {}
+    in_flight = set()
+    for first_page, last_page in _page_ranges(page_numbers):
+        # Bound memory by the number of in-flight page ranges rather than the document length
+        while len(in_flight) >= MAX_IN_FLIGHT:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                results.update(future.result())
+        in_flight.add(pool.submit(_ocr_page_range, pdf_path, first_page, last_page))
+    for future in wait(in_flight).done:
+        results.update(future.result())
+    return [(page_number, results[page_number]) for page_number in sorted(results)]
+
+def has_text_layer(text: str, area: float = LETTER_AREA) -> bool:
+    """Whether a page's embedded text is its body text rather than a stamp on a scan; area in square inches."""
+    return len(_WORD_CHAR.findall(text)) >= MIN_TEXT_LAYER_DENSITY * area
+
+def page_areas(pdf_path: str, page_count: int) -> Dict[int, float]:
+    """Area of every page in square inches, from pdfinfo's per-page sizes (in points)."""
+    try:
+        info = pdfinfo_from_path(pdf_path, first_page=1, last_page=page_count)
+    except Exception as e:
+        logger.warning(f"Page sizes unavailable, assuming letter: {str(e)}")
+        info = {}
+    areas = {}
+    for page_number in range(1, page_count + 1):
+        match = _PAGE_SIZE.match(info.get(f"Page {page_number:4d} size", ""))
+        areas[page_number] = float(match.group(1)) * float(match.group(2)) / 72 ** 2 if match else LETTER_AREA
+    return areas
+
+def extract_text_layer(pdf_path: str) -> List[str]:
+    """Embedded text of every page via poppler's pdftotext, one string per page."""
+    result = subprocess.run(["pdftotext", "-enc", "UTF-8", pdf_path, "-"],
+                            capture_output=True, check=True, timeout=60)
+    pages = result.stdout.decode("utf-8", errors="ignore").split("\f")
+    # pdftotext terminates every page with a form feed, leaving an empty trailing chunk
+    if pages and not pages[-1].strip():
+        pages.pop()
+    return pages
+
+def extract_pdf_pages(pdf_path: str) -> List[PdfPage]:
+    """Text of every page, read from the text layer where there is one and OCR'd otherwise."""
+    page_count = int(pdfinfo_from_path(pdf_path)["Pages"])
+    try:
+        layer = extract_text_layer(pdf_path)
+    except Exception as e:
+        logger.warning(f"Text layer extraction failed, falling back to OCR: {str(e)}")
+        layer = []
+    areas = page_areas(pdf_path, page_count)
+    pages = {}
+    for page_number in range(1, page_count + 1):
+        text = layer[page_number - 1] if page_number <= len(layer) else ""
+        if has_text_layer(text, areas[page_number]):
+            # Same junk rule as OCR output, so a page of form-field digits reads the same either way
+            pages[page_number] = PdfPage(page_number, None if _JUNK_PAGE.search(text) else text.strip(), "text")
+    scanned = [n for n in range(1, page_count + 1) if n not in pages]
+    if scanned:
+        for page_number, text in ocr_pdf_pages(pdf_path, scanned):
+            pages[page_number] = PdfPage(page_number, text, "ocr")
+    return [pages[n] for n in sorted(pages)]
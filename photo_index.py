@@ -0,0 +1,122 @@
+from typing import List, NamedTuple, Optional
+import threading
+import logging
+import sqlite3
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+PHOTO_INDEX_ENABLED = os.environ.get("PHOTO_INDEX_ENABLED", "1") != "0"
+PHOTO_INDEX_PATH = os.environ.get("PHOTO_INDEX_PATH", "photo_index.db")
+# Perceptual hashes at most this many bits apart are treated as the same photo. Up to 3 every such
+# match is found exactly; larger values only find matches that share one 16-bit chunk unchanged.
+PHOTO_REUSE_DISTANCE = int(os.environ.get("PHOTO_REUSE_DISTANCE", "3"))
+# Near-uniform photos (lens covered, blank wall) hash almost all-zero or all-one and match each other
+MIN_HASH_BITS = 8
+
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+class PhotoMatch(NamedTuple):
+    claim: str
+    filename: str
+    distance: int
+
+def hash_chunks(phash: int) -> List[int]:
+    return [(phash >> (CHUNK_BITS * (CHUNKS - 1 - n))) & CHUNK_MASK for n in range(CHUNKS)]
+
+def _indexable(phash: int) -> bool:
+    return MIN_HASH_BITS <= phash.bit_count() <= 64 - MIN_HASH_BITS
+
+class PhotoIndex:
+    """Perceptual hashes of every reviewed photo, by claim, persisted in SQLite.
+
+    Multi-index hashing: each 64-bit hash is stored as four indexed 16-bit chunks. Two hashes within
+    3 bits of each other must agree exactly on at least one chunk, so a lookup is four index probes
+    plus a Hamming check of the few candidates, however many claims are stored.
+    """
+
+    def __init__(self, path: str = PHOTO_INDEX_PATH, enabled: bool = PHOTO_INDEX_ENABLED,
+                 max_distance: int = PHOTO_REUSE_DISTANCE):
+        self.path = path
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = None
+        if enabled:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS photos (
+                    id INTEGER PRIMARY KEY,
+                    c0 INTEGER NOT NULL,
+                    c1 INTEGER NOT NULL,
+                    c2 INTEGER NOT NULL,
+                    c3 INTEGER NOT NULL,
+                    claim TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    document INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (sha256, claim)
+                )""")
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(photos)")]
+            if "document" not in columns:
+                self._conn.execute("ALTER TABLE photos ADD COLUMN document INTEGER NOT NULL DEFAULT 0")
+            for n in range(CHUNKS):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS photos_c{n} ON photos (c{n})")
+
+    def find(self, phash: int, exclude_claim: Optional[str] = None) -> List[PhotoMatch]:
+        """Photos from other claims within max_distance bits of phash, closest first."""
+        if not self.enabled or not _indexable(phash):
+            return []
+        chunks = hash_chunks(phash)
+        # Documents are only ever matched as exact copies (see find_copies)
+        query = " UNION ".join(f"SELECT id, c0, c1, c2, c3, claim, filename FROM photos "
+                               f"WHERE c{n} = ? AND NOT document" for n in range(CHUNKS))
+        with self._lock:
+            rows = self._conn.execute(query, chunks).fetchall()
+        matches = []
+        for _, c0, c1, c2, c3, claim, filename in rows:
+            if claim == exclude_claim:
+                continue
+            distance = (phash ^ (c0 << 48 | c1 << 32 | c2 << 16 | c3)).bit_count()
+            if distance <= self.max_distance:
+                matches.append(PhotoMatch(claim, filename, distance))
+        matches.sort(key=lambda m: m.distance)
+        return matches
+
+    def find_copies(self, sha256: str, exclude_claim: Optional[str] = None) -> List[PhotoMatch]:
+        """Byte-identical uploads from other claims."""
+        if not self.enabled:
+            return []
+        with self._lock:
+            rows = self._conn.execute("SELECT claim, filename FROM photos WHERE sha256 = ?", (sha256,)).fetchall()
+        return [PhotoMatch(claim, filename, 0) for claim, filename in rows if claim != exclude_claim]
+
+    def add(self, phash: int, claim: str, filename: str, sha256: str, document: bool = False):
+        # Documents are kept whatever their hash, since they are matched by sha256 alone
+        if not self.enabled or not (document or _indexable(phash)):
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO photos (c0, c1, c2, c3, claim, filename, sha256, created_at, document) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*hash_chunks(phash), claim, filename, sha256, time.time(), int(document)))
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False, "photos": 0}
+        with self._lock:
+            photos = self._conn.execute("SELECT COUNT(*) FROM photos").fetchone()[0]
+        return {"enabled": True, "photos": photos, "max_distance": self.max_distance}
+
+_index: Optional[PhotoIndex] = None
+
+def get_photo_index() -> PhotoIndex:
+    global _index
+    if _index is None:
+        _index = PhotoIndex()
+    return _index
@@ -0,0 +1,304 @@
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
+import threading
+import tempfile
+import hashlib
+import logging
+import sqlite3
+import time
+import zlib
+import os
+
+logger = logging.getLogger(__name__)
+
+REPORT_STORE_DIR = os.environ.get("REPORT_STORE_DIR", "reports")
+REPORT_FONT_PATH = os.environ.get("REPORT_FONT_PATH", "DejaVuSans.ttf")
+REPORT_FONT_FAMILY = "DejaVu"
+# Embedded font subsets kept per character set; nearly every report uses the base set below
+REPORT_FONT_SUBSETS = 32
+
+# Every report embeds at least these characters (ASCII, typographic punctuation and the marks GPT
+# uses), so reports share one cached subset instead of each building its own from the TTF
+BASE_CHARS = list(range(127)) + [ord(c) for c in "–—‘’“”•…€™✓✔✗✘❌✅⚠"]
+
+class EmbeddedFont(NamedTuple):
+    font_file: bytes  # Compressed TrueType subset
+    font_size: int  # Uncompressed length of the subset
+    cid_to_gid: bytes  # Compressed CIDToGIDMap stream
+    widths: str  # /W array
+
+class ReportFont:
+    """The report font's metrics, parsed from the TTF once per process, and its embedded subsets cached
+    by character set. fpdf otherwise re-reads the TTF for every document and walks all 65536 widths."""
+
+    def __init__(self, path: str = REPORT_FONT_PATH, family: str = REPORT_FONT_FAMILY,
+                 max_subsets: int = REPORT_FONT_SUBSETS):
+        loader = FPDF()
+        loader.add_font(family, "", path, uni=True)
+        self.key = family.lower()
+        self.metrics = loader.fonts[self.key]
+        self.font_files = loader.font_files
+        self.max_subsets = max_subsets
+        self._subsets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _widths(self, codes: Tuple[int, ...]) -> str:
+        cw = self.metrics["cw"]
+        runs: List[Tuple[int, List[int]]] = []
+        for code in codes:
+            width = cw[code] if code < len(cw) else 0
+            if not width:
+                continue
+            width = 0 if width == 65535 else width
+            if runs and runs[-1][0] + len(runs[-1][1]) == code:
+                runs[-1][1].append(width)
+            else:
+                runs.append((code, [width]))
+        return "/W [%s]" % "".join(f" {start} [ {' '.join(str(w) for w in ws)} ]\n" for start, ws in runs)
+
+    def subset(self, chars) -> EmbeddedFont:
+        codes = tuple(sorted(set(chars) - {0}))
+        with self._lock:
+            embedded = self._subsets.get(codes)
+            if embedded is not None:
+                self._subsets.move_to_end(codes)
+                return embedded
+        ttf = TTFontFile()
+        stream = ttf.makeSubset(self.metrics["ttffile"], list(codes))
+        cid_to_gid = bytearray(256 * 256 * 2)
+        for code, glyph in ttf.codeToGlyph.items():
+            cid_to_gid[code * 2] = glyph >> 8
+            cid_to_gid[code * 2 + 1] = glyph & 0xFF
+        embedded = EmbeddedFont(zlib.compress(stream), len(stream), zlib.compress(bytes(cid_to_gid)),
+                                self._widths(codes))
+        with self._lock:
+            self._subsets[codes] = embedded
+            while len(self._subsets) > self.max_subsets:
+                self._subsets.popitem(last=False)
+        return embedded
+
+_font: Optional[ReportFont] = None
+_font_lock = threading.Lock()
+
+def get_report_font() -> ReportFont:
+    global _font
+    with _font_lock:
+        if _font is None:
+            _font = ReportFont()
+        return _font
+
+TO_UNICODE = ("/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n/CIDSystemInfo\n"
+              "<</Registry (Adobe)\n/Ordering (UCS)\n/Supplement 0\n>> def\n/CMapName /Adobe-Identity-UCS def\n"
+              "/CMapType 2 def\n1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n1 beginbfrange\n"
+              "<0000> <FFFF> <0000>\nendbfrange\nendcmap\nCMapName currentdict /CMap defineresource pop\nend\nend")
+
+class ReportTemplate(FPDF):
+    """A report document with the shared font already installed; its font objects are written from
+    the font's cached subset rather than built from the TTF."""
+
+    def __init__(self, font: Optional[ReportFont] = None):
+        super().__init__()
+        self.report_font = font or get_report_font()
+        self.fonts[self.report_font.key] = {**self.report_font.metrics, "i": 1, "subset": list(BASE_CHARS)}
+        self.font_files.update(self.report_font.font_files)
+
+    def _putfonts(self):
+        if len(self.fonts) > 1:
+            return super()._putfonts()
+        font = self.fonts[self.report_font.key]
+        embedded = self.report_font.subset(font["subset"])
+        fontname = "MPDFAA+" + font["name"]
+        font["n"] = self.n + 1
+        # Type0 font, its CIDFontType2 descendant, ToUnicode CMap, CIDSystemInfo, descriptor,
+        # CIDToGIDMap and font file: the same objects fpdf writes for a TTF font
+        self._newobj()
+        self._out("<</Type /Font")
+        self._out("/Subtype /Type0")
+        self._out("/BaseFont /" + fontname)
+        self._out("/Encoding /Identity-H")
+        self._out(f"/DescendantFonts [{self.n + 1} 0 R]")
+        self._out(f"/ToUnicode {self.n + 2} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        self._newobj()
+        self._out("<</Type /Font")
+        self._out("/Subtype /CIDFontType2")
+        self._out("/BaseFont /" + fontname)
+        self._out(f"/CIDSystemInfo {self.n + 2} 0 R")
+        self._out(f"/FontDescriptor {self.n + 3} 0 R")
+        if font["desc"].get("MissingWidth"):
+            self._out("/DW %d" % font["desc"]["MissingWidth"])
+        self._out(embedded.widths)
+        self._out(f"/CIDToGIDMap {self.n + 4} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        self._newobj()
+        self._out(f"<</Length {len(TO_UNICODE)}>>")
+        self._putstream(TO_UNICODE)
+        self._out("endobj")
+
+        self._newobj()
+        self._out("<</Registry (Adobe)")
+        self._out("/Ordering (UCS)")
+        self._out("/Supplement 0")
+        self._out(">>")
+        self._out("endobj")
+
+        self._newobj()
+        self._out("<</Type /FontDescriptor")
+        self._out("/FontName /" + fontname)
+        for key in ("Ascent", "Descent", "CapHeight", "Flags", "FontBBox", "ItalicAngle", "StemV", "MissingWidth"):
+            value = font["desc"][key]
+            if key == "Flags":
+                value = (value | 4) & ~32  # Nonsymbolic
+            self._out(f" /{key} {value}")
+        self._out(f"/FontFile2 {self.n + 2} 0 R")
+        self._out(">>")
+        self._out("endobj")
+
+        self._newobj()
+        self._out(f"<</Length {len(embedded.cid_to_gid)}")
+        self._out("/Filter /FlateDecode")
+        self._out(">>")
+        self._putstream(embedded.cid_to_gid)
+        self._out("endobj")
+
+        self._newobj()
+        self._out(f"<</Length {len(embedded.font_file)}")
+        self._out("/Filter /FlateDecode")
+        self._out(f"/Length1 {embedded.font_size}")
+        self._out(">>")
+        self._putstream(embedded.font_file)
+        self._out("endobj")
+
+def render_report(file_number: str, ia_company: str, appraiser_id: str, fraud_result: dict,
+                  total_loss_status: bool, gpt_output: str) -> bytes:
+    fraud_explanation = fraud_result.get("explanation", "No fraud indicators detected.")
+    pdf = ReportTemplate()
+    pdf.add_page()
+    pdf.set_font(REPORT_FONT_FAMILY, size=11)
+    pdf.cell(200, 10, txt="NSPXN.com AI Review Report", ln=True, align='C')
+    pdf.ln(5)
+    pdf.multi_cell(0, 10, f"File Number: {file_number}")
+    pdf.multi_cell(0, 10, f"IA Company: {ia_company}")
+    pdf.multi_cell(0, 10, f"Appraiser ID #: {appraiser_id}")
+    pdf.ln(5)
+    pdf.set_text_color(200, 0, 0)
+    pdf.multi_cell(0, 10, f"Fraud Risk Score: {fraud_result['score']}%")
+    if fraud_result["flags"]:
+        pdf.set_text_color(0, 0, 0)
+        pdf.multi_cell(0, 10, "Fraud Indicators:")
+        for flag in fraud_result["flags"]:
+            pdf.multi_cell(0, 10, f"- {flag}")
+        pdf.ln(5)
+        pdf.multi_cell(0, 10, "Fraud Risk Explanation:")
+        pdf.multi_cell(0, 10, fraud_explanation)
+    pdf.set_text_color(0, 0, 0)
+    if fraud_result.get("notes"):
+        pdf.ln(5)
+        pdf.multi_cell(0, 10, "Image Forensics Notes (not scored):")
+        for note in fraud_result["notes"]:
+            pdf.multi_cell(0, 10, f"- {note}")
+    pdf.ln(5)
+    pdf.multi_cell(0, 10, f"Total Loss Status: {'Yes' if total_loss_status else 'No'}")
+    pdf.ln(5)
+    pdf.multi_cell(0, 10, "AI-4-IA Review Summary:")
+    pdf.set_font(REPORT_FONT_FAMILY, size=9)
+    pdf.multi_cell(0, 10, gpt_output)
+    return pdf.output(dest="S").encode("latin1")
+
+class StoredReport(NamedTuple):
+    file_number: str
+    version: int
+    sha256: str
+    size: int
+    path: str
+    created_at: float
+
+    @property
+    def filename(self) -> str:
+        return f"{self.file_number}.pdf" if self.version == 1 else f"{self.file_number}_v{self.version}.pdf"
+
+class ReportStore:
+    """Rendered reports, stored once by SHA-256 under objects/ and indexed in SQLite by file number
+    and version. A version (or the latest one) is a single primary-key seek; nothing lists directories."""
+
+    def __init__(self, directory: str = REPORT_STORE_DIR):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                file_number TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (file_number, version)
+            ) WITHOUT ROWID""")
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], f"{sha256}.pdf")
+
+    def _write_object(self, sha256: str, pdf: bytes) -> str:
+        path = self.object_path(sha256)
+        if os.path.exists(path):
+            return path  # Identical report already stored
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as tmp:
+            tmp.write(pdf)
+        os.replace(tmp.name, path)
+        return path
+
+    def save(self, file_number: str, pdf: bytes) -> StoredReport:
+        """Store a rendered report as the next version for its file number."""
+        sha256 = hashlib.sha256(pdf).hexdigest()
+        path = self._write_object(sha256, pdf)
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock first, so concurrent saves never pick the same version
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                latest = self._conn.execute("SELECT MAX(version) FROM reports WHERE file_number = ?",
+                                            (file_number,)).fetchone()[0]
+                version = (latest or 0) + 1
+                self._conn.execute(
+                    "INSERT INTO reports (file_number, version, sha256, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (file_number, version, sha256, len(pdf), now))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return StoredReport(file_number, version, sha256, len(pdf), path, now)
+
+    def get(self, file_number: str, version: Optional[int] = None) -> Optional[StoredReport]:
+        """One version of a file number's report, or its latest version when none is given."""
+        with self._lock:
+            if version is None:
+                row = self._conn.execute(
+                    "SELECT version, sha256, size, created_at FROM reports WHERE file_number = ? "
+                    "ORDER BY version DESC LIMIT 1", (file_number,)).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT version, sha256, size, created_at FROM reports WHERE file_number = ? AND version = ?",
+                    (file_number, version)).fetchone()
+        if row is None:
+            return None
+        version, sha256, size, created_at = row
+        return StoredReport(file_number, version, sha256, size, self.object_path(sha256), created_at)
+
+_store: Optional[ReportStore] = None
+
+def get_report_store() -> ReportStore:
+    global _store
+    if _store is None:
+        _store = ReportStore()
+    return _store
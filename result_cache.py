@@ -0,0 +1,137 @@
+from typing import Optional
+import threading
+import hashlib
+import logging
+import sqlite3
+import pickle
+import metrics
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") != "0"
+CACHE_DB_PATH = os.environ.get("RESULT_CACHE_PATH", "result_cache.db")
+CACHE_MAX_BYTES = int(float(os.environ.get("RESULT_CACHE_MAX_MB", "512")) * 1024 * 1024)
+CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL_HOURS", "168")) * 3600
+
+def content_hash(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")  # Separator so ("ab", "c") and ("a", "bc") hash differently
+    return digest.hexdigest()
+
+class ResultCache:
+    """Content-addressed, size-bounded LRU cache with a TTL, persisted in SQLite so it survives restarts.
+
+    Entries are grouped by namespace (e.g. "pdf_text", "image_ocr", "gpt_review") and hit/miss counters
+    are kept per namespace.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, max_bytes: int = CACHE_MAX_BYTES,
+                 ttl_seconds: float = CACHE_TTL_SECONDS, enabled: bool = CACHE_ENABLED):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = {}
+        self.misses = {}
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._size = 0
+        if enabled:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+            self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, namespace: str, key: str, default=None):
+        if not self.enabled:
+            return default
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, size, created_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)).fetchone()
+            if row is not None and now - row[2] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                self._size -= row[1]
+                row = None
+            if row is None:
+                self.misses[namespace] = self.misses.get(namespace, 0) + 1
+                metrics.CACHE_REQUESTS.inc(namespace=namespace, result="miss")
+                metrics.count("cache_misses")
+                return default
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+            self.hits[namespace] = self.hits.get(namespace, 0) + 1
+        metrics.CACHE_REQUESTS.inc(namespace=namespace, result="hit")
+        metrics.count("cache_hits")
+        return pickle.loads(row[0])
+
+    def set(self, namespace: str, key: str, value):
+        if not self.enabled:
+            return
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT size FROM entries WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (namespace, key, blob, len(blob), now, now))
+            self._size += len(blob) - (previous[0] if previous else 0)
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits its size budget again
+        while self._size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT namespace, key, size FROM entries ORDER BY accessed_at LIMIT 64").fetchall()
+            if not rows:
+                self._size = 0
+                return
+            for namespace, key, size in rows:
+                self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                self._size -= size
+                self.evictions += 1
+                if self._size <= self.max_bytes:
+                    return
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] if self.enabled else 0
+            namespaces = sorted(set(self.hits) | set(self.misses))
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": self.evictions,
+                "namespaces": {
+                    ns: {"hits": self.hits.get(ns, 0), "misses": self.misses.get(ns, 0)} for ns in namespaces
+                },
+            }
+
+_cache: Optional[ResultCache] = None
+
+def get_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
@@ -0,0 +1,87 @@
+from typing import Dict, NamedTuple, Optional
+from docx import Document
+import threading
+import logging
+import time
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+RULES_DIR = os.environ.get("CLIENT_RULES_DIR", "client_rules")
+# How often, at most, the rules directory is re-scanned for changed files
+RULES_RELOAD_SECONDS = float(os.environ.get("CLIENT_RULES_RELOAD_SECONDS", "2"))
+
+_TAX_RATE_RULE = re.compile(r"utilize applicable tax rate", re.IGNORECASE)
+
+class ClientRules(NamedTuple):
+    name: str
+    text: str
+    requires_tax_rate: bool  # Client requires the estimate to show the applicable tax rate
+
+def parse_rules(name: str, text: str) -> ClientRules:
+    """Scan rules text once for the flags the scorer needs."""
+    return ClientRules(name=name, text=text, requires_tax_rate=bool(_TAX_RATE_RULE.search(text)))
+
+class RulesRegistry:
+    """Parsed client_rules/*.docx, loaded once and reloaded when a file's mtime changes."""
+
+    def __init__(self, rules_dir: str = RULES_DIR):
+        self.rules_dir = rules_dir
+        self._rules: Dict[str, ClientRules] = {}
+        self._errors: Dict[str, Exception] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._last_scan = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, path: str) -> ClientRules:
+        doc = Document(path)
+        text = '\n'.join([p.text for p in doc.paragraphs if p.text.strip()])
+        name = os.path.splitext(os.path.basename(path))[0]
+        return parse_rules(name, text)
+
+    def refresh(self, force: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_scan < RULES_RELOAD_SECONDS:
+                return
+            self._last_scan = now
+            try:
+                entries = [e for e in os.scandir(self.rules_dir) if e.is_file() and e.name.lower().endswith(".docx")]
+            except FileNotFoundError:
+                entries = []
+            seen = set()
+            for entry in entries:
+                name = os.path.splitext(entry.name)[0]
+                seen.add(name)
+                mtime = entry.stat().st_mtime
+                if self._mtimes.get(name) == mtime:
+                    continue
+                self._mtimes[name] = mtime
+                try:
+                    self._rules[name] = self._load(entry.path)
+                    self._errors.pop(name, None)
+                    logger.info(f"Loaded client rules for {name}")
+                except Exception as e:
+                    logger.error(f"Client rules error ({name}): {str(e)}")
+                    self._rules.pop(name, None)
+                    self._errors[name] = e
+            for name in set(self._mtimes) - seen:
+                self._mtimes.pop(name, None)
+                self._rules.pop(name, None)
+                self._errors.pop(name, None)
+
+    def get(self, name: str) -> Optional[ClientRules]:
+        """Rules for a client, None if there is no such file; re-raises the parse error of a broken file."""
+        self.refresh()
+        if name in self._errors:
+            raise self._errors[name]
+        return self._rules.get(name)
+
+_registry: Optional[RulesRegistry] = None
+
+def get_registry() -> RulesRegistry:
+    global _registry
+    if _registry is None:
+        _registry = RulesRegistry()
+    return _registry
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pdf_ocr import available_cores
+import contextvars
+import functools
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Blocking work (tesseract, YOLO, docx parsing, FPDF, SMTP) runs here instead of on the event loop.
+# PDF OCR fans out further to the process pool in pdf_ocr.
+STAGE_WORKERS = int(os.environ.get("STAGE_WORKERS", str(max(4, available_cores() * 2))))
+
+# Upper bound on concurrent executor slots per stage, so one stage cannot take the whole pool
+STAGE_LIMITS = {
+    "pdf_text": int(os.environ.get("STAGE_LIMIT_PDF_TEXT", "2")),
+    "docx_text": int(os.environ.get("STAGE_LIMIT_DOCX_TEXT", "4")),
+    "photo_compliance": int(os.environ.get("STAGE_LIMIT_PHOTO_COMPLIANCE", "2")),
+    "advisor_detection": int(os.environ.get("STAGE_LIMIT_ADVISOR_DETECTION", "2")),
+    "field_extraction": int(os.environ.get("STAGE_LIMIT_FIELD_EXTRACTION", "2")),
+    "fraud": int(os.environ.get("STAGE_LIMIT_FRAUD", "2")),
+    "report_pdf": int(os.environ.get("STAGE_LIMIT_REPORT_PDF", "2")),
+    "email": int(os.environ.get("STAGE_LIMIT_EMAIL", "2")),
+}
+DEFAULT_STAGE_LIMIT = int(os.environ.get("STAGE_LIMIT_DEFAULT", "2"))
+
+# Reviews one tenant (IA company) may have in flight at once
+TENANT_MAX_CONCURRENT = int(os.environ.get("TENANT_MAX_CONCURRENT_REVIEWS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+_stage_semaphores = {}
+_tenant_semaphores = {}
+_tenant_users = {}  # Reviews holding or waiting on each tenant's semaphore; idle tenants are dropped
+
+def _stage_semaphore(stage: str) -> asyncio.Semaphore:
+    if stage not in _stage_semaphores:
+        _stage_semaphores[stage] = asyncio.Semaphore(STAGE_LIMITS.get(stage, DEFAULT_STAGE_LIMIT))
+    return _stage_semaphores[stage]
+
+async def run_stage(stage: str, fn, *args, **kwargs):
+    """Run a blocking callable on the stage executor, bounded by the stage's concurrency limit."""
+    async with _stage_semaphore(stage):
+        loop = asyncio.get_running_loop()
+        # Carry context variables (request-scoped state) into the worker thread
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        return await loop.run_in_executor(_executor, call)
+
+def tenant_key(tenant: str) -> str:
+    # "Acme  IA", "acme ia " and "ACME IA" are the same tenant
+    return " ".join((tenant or "").split()).casefold()
+
+@asynccontextmanager
+async def tenant_slot(tenant: str):
+    """Limit how many reviews a single tenant can run concurrently; extra requests wait their turn."""
+    key = tenant_key(tenant)
+    semaphore = _tenant_semaphores.get(key)
+    if semaphore is None:
+        semaphore = _tenant_semaphores[key] = asyncio.Semaphore(TENANT_MAX_CONCURRENT)
+    _tenant_users[key] = _tenant_users.get(key, 0) + 1
+    try:
+        if semaphore.locked():
+            logger.debug(f"Tenant {key!r} at its concurrency limit, queueing review")
+        async with semaphore:
+            yield
+    finally:
+        _tenant_users[key] -= 1
+        if not _tenant_users[key]:
+            del _tenant_users[key]
+            del _tenant_semaphores[key]
@@ -0,0 +1,72 @@
+from PIL import Image, ImageDraw
+from benchmark import fixtures
+from fraud_check import PHOTO_REUSE_SCORE, check_image_forensics
+from image_analysis import ImageAnalysisSet
+from photo_index import PhotoIndex
+from types import SimpleNamespace
+from uploads import SpooledUpload
+import random
+import pytest
+import io
+
+def _report_page(seed: int) -> bytes:
+    """A screenshot of a report template: the same header and line layout, different text."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (850, 1100), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((40, 40, 810, 90), fill=(30, 60, 140))
+    draw.text((60, 58), "CCC ADVISOR REPORT", fill=(255, 255, 255))
+    for line in range(45):
+        draw.text((60, 120 + line * 20), "".join(rng.choice("ABCDEFGH 0123456789$.") for _ in range(90)), fill=(0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def _reencoded(data: bytes, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(data)).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+def _analyses(*files):
+    uploads = [SpooledUpload.adopt(SimpleNamespace(filename=name, file=io.BytesIO(data))) for name, data in files]
+    return ImageAnalysisSet(uploads).items
+
+@pytest.fixture
+def photo_index(tmp_path):
+    return PhotoIndex(str(tmp_path / "photo_index.db"))
+
+def test_same_layout_documents_are_not_reuse(photo_index):
+    first, second = _analyses(("advisor.png", _report_page(1)), ("advisor.png", _report_page(2)))
+    # The perceptual hash cannot tell the two pages apart
+    assert (first.phash ^ second.phash).bit_count() <= photo_index.max_distance
+    assert first.is_document and second.is_document
+    check_image_forensics([first], "CLAIM-A", photo_index)
+    findings = check_image_forensics([second], "CLAIM-B", photo_index)
+    assert not any("already submitted" in flag for flag in findings["flags"])
+
+def test_light_photos_are_not_documents():
+    # Seed 11 has a light grey background with a few boxes: mostly "paper" by colour, but no text on it
+    assert not any(analysis.is_document for analysis in _analyses(
+        *((f"p{seed}.jpg", fixtures.photo((2000, 1500), seed)) for seed in range(8, 16))))
+
+def test_copied_document_is_reuse(photo_index):
+    page = _report_page(1)
+    check_image_forensics(_analyses(("advisor.png", page)), "CLAIM-A", photo_index)
+    findings = check_image_forensics(_analyses(("advisor.png", page)), "CLAIM-B", photo_index)
+    assert "Photo advisor.png was already submitted with claim CLAIM-A" in findings["flags"]
+
+def test_reuse_scores_once_per_claim(photo_index):
+    photos = [fixtures.photo((800, 600), seed) for seed in (1, 2, 3)]
+    check_image_forensics(_analyses(*((f"p{n}.jpg", p) for n, p in enumerate(photos))), "CLAIM-A", photo_index)
+    resubmitted = [(f"q{n}.jpg", _reencoded(p, 85)) for n, p in enumerate(photos)]
+    unindexed = check_image_forensics(_analyses(*resubmitted))
+    findings = check_image_forensics(_analyses(*resubmitted), "CLAIM-B", photo_index)
+    assert sum("already submitted" in flag for flag in findings["flags"]) == 3
+    assert findings["score"] == unindexed["score"] + PHOTO_REUSE_SCORE
+
+def test_low_jpeg_quality_is_a_note():
+    photo = fixtures.photo((800, 600), 1)
+    default, low = (check_image_forensics(_analyses(("p.jpg", _reencoded(photo, quality))))
+                    for quality in (75, 60))
+    assert low["score"] == default["score"]
+    assert low["notes"] == ["High compression in p.jpg (JPEG quality 60)"] and not default["notes"]
@@ -0,0 +1,69 @@
+from PIL import Image, ImageDraw
+from benchmark import fixtures
+from image_forensics import ELA_MIN_TEXTURED_SHARE, error_level_analysis, estimate_jpeg_quality
+import numpy as np
+import pytest
+import io
+
+def _jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+def _open(data: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+def _ela(data: bytes):
+    image = _open(data)
+    return error_level_analysis(image, estimate_jpeg_quality(image.quantization))
+
+def _scene(seed: int, size=(800, 600), text: bool = True) -> Image.Image:
+    """Photo-like texture (1/f noise, calm at the top and busy at the bottom) with VIN and odometer plates."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    frequency = np.hypot(np.fft.fftfreq(height)[:, None], np.fft.fftfreq(width)[None, :])
+    amplitude = 1 / np.maximum(frequency, 1 / max(size))
+    strength = np.linspace(0.2, 1.5, height)[:, None]
+    channels = []
+    for offset in (0, 10, 20):
+        noise = np.real(np.fft.ifft2(amplitude * np.exp(2j * np.pi * rng.random((height, width)))))
+        channels.append(120 + offset + 40 * strength * (noise - noise.mean()) / noise.std())
+    image = Image.fromarray(np.clip(np.stack(channels, -1), 0, 255).astype(np.uint8))
+    if text:
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            x, y = int(rng.integers(0, width - 280)), int(rng.integers(0, height - 30))
+            draw.rectangle((x, y, x + 260, y + 24), fill=(255, 255, 255))
+            draw.text((x + 5, y + 6), f"VIN 1HGCM82633A{seed:06d} ODO 42,118", fill=(0, 0, 0))
+    return image
+
+def _splice(seed: int, background_quality: int, final_quality: int) -> bytes:
+    """A phone photo with a region pasted from another picture, saved again by an editor."""
+    image = _open(_jpeg(_scene(seed), background_quality)).convert("RGB")
+    width, height = image.size
+    image.paste(_scene(seed + 100, text=False).crop((0, 0, width // 5, height // 5)), (width // 3 + 3, height // 2 + 5))
+    return _jpeg(image, final_quality)
+
+@pytest.mark.parametrize("seed", range(10))
+def test_clean_benchmark_photos_pass(seed):
+    result = _ela(fixtures.photo((1600, 1200), seed))
+    assert not result.suspicious
+
+@pytest.mark.parametrize("quality", [70, 85, 90, 92, 95, 98])
+def test_clean_textured_photos_with_text_pass(quality):
+    for seed in range(3):
+        result = _ela(_jpeg(_scene(seed), quality))
+        assert result.textured_share >= ELA_MIN_TEXTURED_SHARE  # Actually compared, not skipped
+        assert not result.suspicious, (seed, result)
+
+@pytest.mark.parametrize("background_quality,final_quality", [(70, 95), (75, 95), (85, 92), (70, 90)])
+def test_spliced_photo_is_flagged(background_quality, final_quality):
+    for seed in range(3):
+        result = _ela(_splice(seed, background_quality, final_quality))
+        assert result.suspicious, (seed, result)
+
+@pytest.mark.parametrize("quality", [30, 50, 75, 90, 95])
+def test_estimate_jpeg_quality(quality):
+    assert estimate_jpeg_quality(_open(_jpeg(_scene(1, text=False), quality)).quantization) == quality
@@ -0,0 +1,39 @@
+from benchmark import fixtures
+import pdf_ocr
+import pytest
+
+FAX_BANNER = "Received 03/14/2025 10:42 From: Acme Independent Appraisers  Fax: 555-0100  Page {page} of 3"
+
+@pytest.fixture
+def pdf(monkeypatch):
+    """A three page PDF: a digital estimate page, a scan stamped with a fax banner, and an A6 receipt."""
+    estimate = "\n".join(fixtures.estimate_text(1, 1))
+    layer = [estimate + "\n" + FAX_BANNER.format(page=1), FAX_BANNER.format(page=2),
+             "Paint materials receipt\nBase coat 2 qt  $184.00\nClear coat 1 qt  $96.00\nTotal $280.00"]
+    info = {"Pages": 3, "Page    1 size": "612 x 792 pts (letter)", "Page    2 size": "612 x 792 pts (letter)",
+            "Page    3 size": "298 x 420 pts (A6)"}
+    ocr_calls = []
+
+    def ocr_pdf_pages(path, page_numbers):
+        ocr_calls.extend(page_numbers)
+        return [(n, f"OCR text of page {n}") for n in page_numbers]
+
+    monkeypatch.setattr(pdf_ocr, "pdfinfo_from_path", lambda path, **kwargs: info)
+    monkeypatch.setattr(pdf_ocr, "extract_text_layer", lambda path: layer)
+    monkeypatch.setattr(pdf_ocr, "ocr_pdf_pages", ocr_pdf_pages)
+    return ocr_calls
+
+def test_stamped_scan_is_ocrd(pdf):
+    pages = pdf_ocr.extract_pdf_pages("claim.pdf")
+    assert [(page.number, page.method) for page in pages] == [(1, "text"), (2, "ocr"), (3, "text")]
+    assert pages[1].text == "OCR text of page 2"
+    assert pdf == [2]
+
+def test_text_density_is_relative_to_page_size():
+    receipt = "Paint materials receipt Base coat 2 qt $184.00 Clear coat 1 qt $96.00 Total $280.00"
+    assert pdf_ocr.has_text_layer(receipt, area=298 * 420 / 72 ** 2)
+    assert not pdf_ocr.has_text_layer(receipt)
+
+def test_missing_page_sizes_assume_letter(monkeypatch):
+    monkeypatch.setattr(pdf_ocr, "pdfinfo_from_path", lambda path, **kwargs: {"Pages": 2})
+    assert pdf_ocr.page_areas("claim.pdf", 2) == {1: pdf_ocr.LETTER_AREA, 2: pdf_ocr.LETTER_AREA}
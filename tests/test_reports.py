@@ -0,0 +1,109 @@
+from reports import ReportFont, ReportStore, ReportTemplate, REPORT_FONT_FAMILY, render_report
+import reports
+import pytest
+import shutil
+import zlib
+import os
+import re
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DejaVuSans.ttf")
+
+FRAUD_RESULT = {"score": 35, "flags": ["VIN mismatch between estimate and photo"],
+                "explanation": "One photo's VIN does not match the estimate.",
+                "notes": ["Localized compression differences in front.jpg (3.1% of its textured area)"]}
+
+@pytest.fixture
+def font(tmp_path, monkeypatch):
+    # fpdf caches parsed metrics next to the TTF, so work on a copy
+    path = str(tmp_path / "DejaVuSans.ttf")
+    shutil.copy(FONT_PATH, path)
+    font = ReportFont(path)
+    monkeypatch.setattr(reports, "_font", font)
+    return font
+
+def _objects(pdf: bytes) -> dict:
+    """Object number -> body, after checking every xref offset points at its object."""
+    assert pdf.startswith(b"%PDF-1.")
+    assert pdf.rstrip().endswith(b"%%EOF")
+    startxref = int(re.search(rb"startxref\s+(\d+)\s+%%EOF\s*$", pdf).group(1))
+    assert pdf[startxref:].startswith(b"xref")
+    header = re.match(rb"xref\s+0 (\d+)\s+", pdf[startxref:])
+    count = int(header.group(1))
+    entries = re.findall(rb"(\d{10}) \d{5} ([nf])", pdf[startxref + header.end():])[:count]
+    assert len(entries) == count
+    objects = {}
+    for number, (offset, kind) in enumerate(entries):
+        if kind == b"f":
+            continue
+        offset = int(offset)
+        assert pdf[offset:].startswith(b"%d 0 obj" % number)
+        objects[number] = pdf[offset:pdf.index(b"endobj", offset)]
+    return objects
+
+def _stream(body: bytes) -> bytes:
+    length = int(re.search(rb"/Length (\d+)", body).group(1))
+    start = body.index(b"stream") + len(b"stream")
+    start += 2 if body[start:start + 2] == b"\r\n" else 1
+    return body[start:start + length]
+
+def _font_objects(objects: dict):
+    type0 = next(body for body in objects.values() if b"/Subtype /Type0" in body)
+    cid_font = objects[int(re.search(rb"/DescendantFonts \[(\d+) 0 R\]", type0).group(1))]
+    descriptor = objects[int(re.search(rb"/FontDescriptor (\d+) 0 R", cid_font).group(1))]
+    return type0, cid_font, descriptor
+
+def test_report_pdf_structure(font):
+    pdf = render_report("F1", "Acme IA", "A-17", FRAUD_RESULT, False, "Compliance Score: 85% ✓ Ω €1,200")
+    objects = _objects(pdf)
+    type0, cid_font, descriptor = _font_objects(objects)
+    assert b"/Encoding /Identity-H" in type0
+    assert b"/Subtype /CIDFontType2" in cid_font
+    assert b"/CIDToGIDMap" in cid_font
+
+    # Widths cover the base set plus the characters this report added (U+03A9 is outside BASE_CHARS)
+    widths = re.search(rb"/W \[(.*?)\]\s*\n/CIDToGIDMap", cid_font, re.S).group(1)
+    starts = {int(start) for start in re.findall(rb"(\d+) \[", widths)}
+    assert 32 in starts and 0x03A9 in starts
+
+    font_file = objects[int(re.search(rb"/FontFile2 (\d+) 0 R", descriptor).group(1))]
+    length1 = int(re.search(rb"/Length1 (\d+)", font_file).group(1))
+    assert len(zlib.decompress(_stream(font_file))) == length1
+    to_unicode = objects[int(re.search(rb"/ToUnicode (\d+) 0 R", type0).group(1))]
+    assert b"begincmap" in _stream(to_unicode)
+
+def test_reports_share_the_cached_font_subset(font):
+    first = render_report("F1", "Acme IA", "A-17", FRAUD_RESULT, False, "Compliance Score: 85%")
+    second = render_report("F2", "Acme IA", "A-18", FRAUD_RESULT, True, "Compliance Score: 60%")
+    assert len(font._subsets) == 1
+    for pdf in (first, second):
+        _objects(pdf)
+
+def test_other_fonts_fall_back_to_fpdf(font):
+    pdf = ReportTemplate(font)
+    pdf.add_page()
+    pdf.set_font("Arial", size=11)
+    pdf.cell(0, 10, txt="Core font")
+    pdf.set_font(REPORT_FONT_FAMILY, size=11)
+    pdf.cell(0, 10, txt="Report font")
+    objects = _objects(pdf.output(dest="S").encode("latin1"))
+    assert any(b"/BaseFont /Helvetica" in body for body in objects.values())
+    assert any(b"/Subtype /Type0" in body for body in objects.values())
+
+def test_report_store_versions(tmp_path):
+    store = ReportStore(str(tmp_path))
+    first = store.save("F1", b"%PDF-1.3 first")
+    second = store.save("F1", b"%PDF-1.3 second")
+    assert (first.version, second.version) == (1, 2)
+    assert (first.filename, second.filename) == ("F1.pdf", "F1_v2.pdf")
+    assert store.get("F1") == second
+    assert store.get("F1", 1) == first
+    assert store.get("F1", 3) is None
+    assert store.get("F2") is None
+    with open(store.get("F1", 1).path, "rb") as f:
+        assert f.read() == b"%PDF-1.3 first"
+
+def test_report_store_keeps_identical_reports_once(tmp_path):
+    store = ReportStore(str(tmp_path))
+    first = store.save("F1", b"%PDF-1.3 same")
+    second = store.save("F1", b"%PDF-1.3 same")
+    assert second.version == 2 and second.path == first.path
@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from typing import Callable, List, Optional
+import threading
+import tempfile
+import hashlib
+import logging
+import shutil
+import mmap
+import io
+import os
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# Total upload size and decoded-raster memory one review may use before it is rejected with 413
+REQUEST_MAX_UPLOAD_BYTES = int(os.environ.get("REQUEST_MAX_UPLOAD_MB", "200")) * 1024 * 1024
+REQUEST_MEMORY_BUDGET_BYTES = int(os.environ.get("REQUEST_MEMORY_BUDGET_MB", "256")) * 1024 * 1024
+UPLOAD_TMP_DIR = os.environ.get("UPLOAD_TMP_DIR") or None
+
+class RequestTooLarge(Exception):
+    """The request cannot be processed within its size or memory limits (reported as HTTP 413)."""
+
+class MemoryBudget:
+    """Bytes one request holds in memory: small uploads kept in RAM plus decoded image rasters.
+
+    Rasters are registered with a release callback. When a new raster would exceed the budget, the
+    oldest ones are dropped first (they are decoded again if something still needs them), so a
+    request only fails when a single file cannot fit at all.
+    """
+
+    def __init__(self, limit: int = REQUEST_MEMORY_BUDGET_BYTES):
+        self.limit = limit
+        self.pinned = 0
+        self.peak = 0
+        self.evictions = 0
+        self.error: Optional[RequestTooLarge] = None
+        self._holds = OrderedDict()  # owner -> (bytes, release callback)
+        self._held = 0
+        self._lock = threading.Lock()
+
+    @property
+    def used(self) -> int:
+        return self.pinned + self._held
+
+    def _fail(self, message: str):
+        error = RequestTooLarge(message)
+        if self.error is None:
+            self.error = error
+        raise error
+
+    def pin(self, nbytes: int, what: str):
+        """Memory held for the whole request, such as an upload small enough to stay in RAM."""
+        with self._lock:
+            if self.pinned + nbytes > self.limit:
+                self._fail(f"{what} does not fit in the {self.limit // (1024 * 1024)} MB per-request memory budget. "
+                           f"Send fewer or smaller files.")
+            self.pinned += nbytes
+            self.peak = max(self.peak, self.used)
+
+    def hold(self, owner, nbytes: int, release: Callable[[], None], what: str):
+        evicted = []
+        with self._lock:
+            if self.pinned + nbytes > self.limit:
+                self._fail(f"{what} needs about {nbytes // (1024 * 1024)} MB decoded, more than the "
+                           f"{self.limit // (1024 * 1024)} MB per-request memory budget allows. "
+                           f"Send a smaller or lower-resolution file.")
+            previous = self._holds.pop(owner, None)
+            if previous is not None:
+                self._held -= previous[0]
+            while self.used + nbytes > self.limit and self._holds:
+                _, (size, callback) = self._holds.popitem(last=False)
+                self._held -= size
+                self.evictions += 1
+                evicted.append(callback)
+            self._holds[owner] = (nbytes, release)
+            self._held += nbytes
+            self.peak = max(self.peak, self.used)
+        for callback in evicted:
+            callback()
+
+    def release(self, owner):
+        with self._lock:
+            previous = self._holds.pop(owner, None)
+            if previous is not None:
+                self._held -= previous[0]
+
+    def raise_if_exceeded(self):
+        if self.error is not None:
+            raise self.error
+
+class SpooledUpload:
+    """An uploaded file kept where the multipart parser spooled it, never copied into one bytes object.
+
+    The SHA-256 is computed by streaming the file once. Consumers read it through independent file
+    handles, a memory map or a filesystem path instead of sharing a bytes copy.
+    """
+
+    def __init__(self, filename: str, file, size: int, sha256: str):
+        self.filename = filename
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+        self._tmp_path: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def adopt(cls, upload, budget: Optional[MemoryBudget] = None) -> "SpooledUpload":
+        """Hash and size an UploadFile (or any object with .filename and .file) in chunks."""
+        file = upload.file
+        file.seek(0)
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+        file.seek(0)
+        spooled = cls(upload.filename, file, size, digest.hexdigest())
+        if budget is not None and spooled.in_memory:
+            budget.pin(size, upload.filename)
+        return spooled
+
+    @property
+    def in_memory(self) -> bool:
+        # SpooledTemporaryFile keeps small files in a BytesIO until they pass its max_size
+        return isinstance(self._memory(), io.BytesIO)
+
+    def _memory(self):
+        return getattr(self.file, "_file", self.file)
+
+    def _named_path(self) -> Optional[str]:
+        name = getattr(self.file, "name", None)
+        return name if isinstance(name, str) and os.path.isfile(name) else None
+
+    def _mmap(self) -> mmap.mmap:
+        path = self._named_path()
+        if path:
+            with open(path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def path(self) -> str:
+        """A filesystem path with the content, for tools that need one (poppler, tesseract)."""
+        with self._lock:
+            existing = self._named_path() or self._tmp_path
+            if existing:
+                return existing
+            suffix = os.path.splitext(self.filename)[1]
+            with tempfile.NamedTemporaryFile(suffix=suffix, dir=UPLOAD_TMP_DIR, delete=False) as tmp, self.open() as src:
+                shutil.copyfileobj(src, tmp, CHUNK_SIZE)
+            self._tmp_path = tmp.name
+            return self._tmp_path
+
+    def open(self):
+        """A read-only file object with its own position, safe to use alongside other readers."""
+        if self.in_memory:
+            return io.BytesIO(self._memory().getvalue())
+        if not self.size:
+            return io.BytesIO()
+        path = self._named_path()
+        return open(path, "rb") if path else self._mmap()
+
+    def read_bytes(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+    def close(self):
+        with self._lock:
+            if self._tmp_path:
+                try:
+                    os.remove(self._tmp_path)
+                except OSError:
+                    pass
+                self._tmp_path = None
+
+def adopt_uploads(files, budget: MemoryBudget, max_bytes: int = REQUEST_MAX_UPLOAD_BYTES) -> List[SpooledUpload]:
+    uploads = []
+    total = 0
+    for file in files:
+        upload = SpooledUpload.adopt(file, budget)
+        uploads.append(upload)
+        total += upload.size
+        if total > max_bytes:
+            for u in uploads:
+                u.close()
+            raise RequestTooLarge(f"Uploads total more than {max_bytes // (1024 * 1024)} MB. "
+                                  f"Send fewer or smaller files.")
+    return uploads